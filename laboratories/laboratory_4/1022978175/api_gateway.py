@@ -1,11 +1,17 @@
 from flask import Flask, request, jsonify
 import jwt
 import requests
+import os
 import time
+import math
 from functools import wraps
 from threading import Thread
 import random
 
+from cache_protocol import LEVELS, CacheClient
+from near_cache import NearCache
+from single_flight import SingleFlight
+
 app = Flask(__name__)
 SECRET_KEY = "secret"
 
@@ -16,6 +22,31 @@ database_service = "http://127.0.0.1:5002"
 microservice = "http://127.0.0.1:5001"
 worker_service = "http://127.0.0.1:5005"
 
+# host:port of the cache service binary protocol (e.g. 127.0.0.1:5014); when set,
+# gets, sets and deletes use it instead of HTTP
+cache_tcp_service = os.environ.get("CACHE_TCP_SERVICE")
+cache_client = None
+if cache_tcp_service:
+    host, port = cache_tcp_service.rsplit(":", 1)
+    cache_client = CacheClient(host, int(port))
+
+# Concurrent cache misses on the same key share one backend load
+loads = SingleFlight()
+
+# In-process L0 cache in front of the cache service, invalidated by messages pushed from it
+near_cache = NearCache(max_entries=256, ttl=2.0)
+near_cache_url = f"http://127.0.0.1:{service_port}/near-cache/invalidate"
+
+# Freshness policy per route. Entries are fresh for soft_ttl seconds, then served
+# stale for up to stale_ttl more seconds while one background refresh runs. beta
+# scales the probabilistic early refresh (XFetch) of fresh entries; 0 disables it.
+# Entries are tagged with the backends they come from, so a write to a backend can
+# invalidate everything derived from it (POST /cache/invalidate {"tags": ["db"]}).
+CACHE_POLICIES = {
+    "/data": {"soft_ttl": 300, "stale_ttl": 60, "beta": 1.0, "tags": ["db"]},
+    "/data/complex": {"soft_ttl": 60, "stale_ttl": 30, "beta": 1.0, "tags": ["db", "microservice"]},
+}
+
 # Decorators
 def token_required(f):
     @wraps(f)
@@ -52,23 +83,159 @@ def with_metrics(f):
 
 # Cache strategies
 def cache_data(key, ttl=None, level=None):
-    """Try to get data from cache"""
+    """Try to get data from cache, first from the near-cache unless a level is requested"""
     params = {}
     if level:
         params["level"] = level
+    else:
+        found, value = near_cache.get(key)
+        if found:
+            return {"value": value, "hit": True, "level": "L0"}
     
-    cache_resp = requests.get(f"{cache_service}/cache/{key}", params=params).json()
+    version = near_cache.version()
+    if cache_client:
+        cache_resp = cache_client.get(key)
+    else:
+        cache_resp = requests.get(f"{cache_service}/cache/{key}", params=params).json()
+    if cache_resp.get("hit", False):
+        near_cache.put(key, cache_resp["value"], version)
     return cache_resp
 
-def update_cache(key, value, ttl=None, level="all"):
+def update_cache(key, value, ttl=None, level="all", tags=None):
     """Update the cache with new data"""
     payload = {"value": value}
     if ttl:
         payload["ttl"] = ttl
     if level:
         payload["level"] = level
+    if tags:
+        payload["tags"] = tags
+    
+    near_cache.invalidate([key])
+    if cache_client:
+        cache_client.set(key, value, payload.get("ttl"), payload.get("level", "all"), tags)
+    else:
+        requests.post(f"{cache_service}/cache/{key}", json=payload)
+
+def cache_mget(keys):
+    """Get several keys from the cache in one round trip, as {key: cache result}"""
+    if not keys:
+        return {}
+    if cache_client:
+        return cache_client.mget(keys)
+    return requests.post(f"{cache_service}/cache/mget", json={"keys": keys}).json()["results"]
+
+def cache_mset(items):
+    """Update several cache entries in one round trip.
+    Each item is a dict with key, value and optionally ttl, level and tags."""
+    if items:
+        near_cache.invalidate([item["key"] for item in items])
+        if cache_client:
+            cache_client.mset(items)
+        else:
+            requests.post(f"{cache_service}/cache/mset", json={"items": items})
+
+def cache_mdel(keys):
+    """Delete several keys from the cache in one round trip, returning how many were cached"""
+    if not keys:
+        return 0
+    near_cache.invalidate(keys)
+    if cache_client:
+        return cache_client.mdel(keys)
+    return requests.post(f"{cache_service}/cache/mdel", json={"keys": keys}).json()["deleted"]
+
+def cache_invalidate(tags=(), prefixes=()):
+    """Delete every key with any of the tags or key prefixes, returning the keys deleted.
+    Raises ValueError with the cache service's error when it refuses the request,
+    e.g. tags sent to cache.py, which does not keep them."""
+    response = requests.post(f"{cache_service}/cache/invalidate",
+                             json={"tags": list(tags), "prefixes": list(prefixes)})
+    if response.status_code == 400:
+        raise ValueError(response.json().get("error", "invalid invalidation request"))
+    response.raise_for_status()
+    keys = response.json()["keys"]
+    near_cache.invalidate(keys)
+    return keys
+
+def cache_entry(value, soft_ttl, load_time):
+    """Value wrapped with the metadata used to decide when to refresh it"""
+    return {"data": value, "fresh_until": time.time() + soft_ttl, "load_time": load_time}
+
+def is_fresh(entry):
+    return isinstance(entry, dict) and "fresh_until" in entry and time.time() < entry["fresh_until"]
+
+def loader_for(key, load, policy, soft_ttl, level="all"):
+    """Wrap load so its result is cached with its freshness metadata"""
+    def load_and_cache():
+        start = time.time()
+        value = load()
+        entry = cache_entry(value, soft_ttl, time.time() - start)
+        # The cache keeps the entry for the stale period too
+        update_cache(key, entry, ttl=soft_ttl + policy["stale_ttl"], level=level, tags=policy["tags"])
+        return value
+    return load_and_cache
+
+def early_refresh_due(entry, beta, now):
+    """XFetch: refresh a fresh entry ahead of time with a probability that grows as
+    fresh_until gets closer, and sooner for entries that are slow to load"""
+    return now - entry["load_time"] * beta * math.log(1 - random.random()) >= entry["fresh_until"]
+
+def refresh_in_background(key, loader):
+    """Start a refresh of key unless a load of it is already running"""
+    if loads.running(key):
+        return
     
-    requests.post(f"{cache_service}/cache/{key}", json=payload)
+    def refresh():
+        try:
+            loads.do(key, loader)
+        except (requests.RequestException, OSError) as e:
+            print(f"Background refresh of {key} failed: {e}")
+    
+    Thread(target=refresh, daemon=True).start()
+
+def read_through(route, key, load, soft_ttl=None, level=None, bypass=False):
+    """Serve key from the cache following the freshness policy of route, loading it on a miss.
+    Returns the value and a dict describing how it was served."""
+    policy = CACHE_POLICIES[route]
+    loader = loader_for(key, load, policy, soft_ttl or policy["soft_ttl"], level or "all")
+    
+    # A bypass asks for a fresh load
+    if bypass:
+        return loader(), {'cached': False, 'coalesced': False}
+    
+    cache_result = cache_data(key, level=level)
+    entry = cache_result.get("value") if cache_result.get("hit", False) else None
+    if isinstance(entry, dict) and "fresh_until" in entry:
+        now = time.time()
+        stale = now >= entry["fresh_until"]
+        refreshing = stale or early_refresh_due(entry, policy["beta"], now)
+        if refreshing:
+            refresh_in_background(key, loader)
+        return entry["data"], {
+            'cached': True,
+            'cache_level': cache_result.get("level", "unknown"),
+            'stale': stale,
+            'refreshing': refreshing
+        }
+    
+    # Miss: concurrent misses wait for the load already running
+    value, coalesced = loads.do(key, loader)
+    return value, {'cached': False, 'coalesced': coalesced}
+
+def fetch_complex_data():
+    """Fetch and combine the data of the complex endpoint from the backend services"""
+    # Simulate multiple backend calls
+    db_resp = requests.get(f"{database_service}/db").json()
+    time.sleep(0.2)  # Simulate additional processing time
+    
+    service_resp = requests.get(f"{microservice}/process").json()
+    
+    # Combine results
+    return {
+        "db_data": db_resp['message'],
+        "service_data": service_resp['message'],
+        "timestamp": time.time()
+    }
 
 # Routes
 @app.route("/health", methods=["GET"])
@@ -86,30 +253,22 @@ def get_data():
     bypass_cache = request.args.get("bypass_cache", "false").lower() == "true"
     cache_ttl = request.args.get("cache_ttl", type=int, default=300)  # Default 5 minutes
     cache_level = request.args.get("cache_level")
+    if cache_level and cache_level not in LEVELS:
+        return jsonify({"error": f"cache_level must be one of {', '.join(LEVELS)}"}), 400
     
-    # Check cache unless bypassed
-    if not bypass_cache:
-        cache_result = cache_data("my_data", level=cache_level)
-        if cache_result.get("hit", False):
-            level = cache_result.get("level", "unknown")
-            return jsonify({
-                'cached': True, 
-                'cache_level': level, 
-                'data': cache_result['value']
-            })
-    
-    # Cache miss or bypass, fetch from DB with simulated latency
-    print("Cache miss or bypass, fetching from DB")
-    time.sleep(random.uniform(0.1, 0.3))  # Simulate DB access latency
-    
-    db_resp = requests.get(f"{database_service}/db").json()
+    def load():
+        # Fetch from DB with simulated latency
+        print("Cache miss or bypass, fetching from DB")
+        time.sleep(random.uniform(0.1, 0.3))  # Simulate DB access latency
+        
+        db_resp = requests.get(f"{database_service}/db").json()
+        return db_resp['message']
     
-    # Update cache with new value
-    update_cache("my_data", db_resp['message'], ttl=cache_ttl, level=cache_level or "all")
+    data, served = read_through("/data", "my_data", load, soft_ttl=cache_ttl, level=cache_level, bypass=bypass_cache)
     
     return jsonify({
-        'cached': False,
-        'data': db_resp['message'],
+        **served,
+        'data': data,
         'cache_ttl': cache_ttl
     })
 
@@ -120,55 +279,88 @@ def get_complex_data():
     """Endpoint that demonstrates cache invalidation patterns"""
     cache_key = f"complex_data_{request.args.get('id', 'default')}"
     
-    # Check if we have it in cache
-    cache_result = cache_data(cache_key)
-    if cache_result.get("hit", False):
-        return jsonify({
-            'cached': True,
-            'data': cache_result['value']
-        })
+    def load():
+        # Cache miss - fetch from multiple sources and combine
+        # This demonstrates why caching is important for complex operations
+        print("Complex data cache miss, fetching from multiple services")
+        return fetch_complex_data()
     
-    # Cache miss - fetch from multiple sources and combine
-    # This demonstrates why caching is important for complex operations
-    print("Complex data cache miss, fetching from multiple services")
+    # The complex data route has a shorter TTL, see CACHE_POLICIES
+    combined_data, served = read_through("/data/complex", cache_key, load)
     
-    # Simulate multiple backend calls
-    db_resp = requests.get(f"{database_service}/db").json()
-    time.sleep(0.2)  # Simulate additional processing time
+    return jsonify({
+        **served,
+        'data': combined_data
+    })
+
+@app.route("/data/complex/batch", methods=["GET"])
+@token_required
+@with_metrics
+def get_complex_data_batch():
+    """Complex data for several ids (?ids=1,2,3), read from and written to the cache in one round trip each"""
+    ids = [id_ for id_ in request.args.get("ids", "").split(",") if id_]
+    if not ids:
+        return jsonify({"error": "ids required"}), 400
     
-    service_resp = requests.get(f"{microservice}/process").json()
+    keys = {id_: f"complex_data_{id_}" for id_ in ids}
+    cache_results = cache_mget(list(keys.values()))
     
-    # Combine results
-    combined_data = {
-        "db_data": db_resp['message'],
-        "service_data": service_resp['message'],
-        "timestamp": time.time()
-    }
+    data = {}
+    cached = {}
+    missing = []
+    for id_, key in keys.items():
+        cache_result = cache_results.get(key, {})
+        # Stale entries are reloaded with the misses
+        cached[id_] = cache_result.get("hit", False) and is_fresh(cache_result["value"])
+        if cached[id_]:
+            data[id_] = cache_result["value"]["data"]
+        else:
+            missing.append(id_)
     
-    # Cache the combined result - shorter TTL for complex data
-    update_cache(cache_key, combined_data, ttl=60)
+    # The backends are called once for all the missing ids
+    if missing:
+        print(f"Complex data cache miss for {len(missing)} ids, fetching from multiple services")
+        policy = CACHE_POLICIES["/data/complex"]
+        start = time.time()
+        combined_data = fetch_complex_data()
+        entry = cache_entry(combined_data, policy["soft_ttl"], time.time() - start)
+        for id_ in missing:
+            data[id_] = combined_data
+        cache_mset([{"key": keys[id_], "value": entry, "ttl": policy["soft_ttl"] + policy["stale_ttl"],
+                     "tags": policy["tags"]} for id_ in missing])
     
     return jsonify({
-        'cached': False,
-        'data': combined_data
+        'cached': cached,
+        'data': data
     })
 
 @app.route("/cache/invalidate", methods=["POST"])
 @token_required
 def invalidate_cache():
-    """Endpoint to explicitly invalidate cache entries"""
+    """Endpoint to explicitly invalidate cache entries, given a key, a list of keys,
+    or tags and key prefixes (e.g. {"prefixes": ["complex_data_"]}) that select a group"""
     data = request.json
-    key = data.get("key")
+    keys = data.get("keys") or ([data["key"]] if data.get("key") else [])
+    tags = data.get("tags", [])
+    prefixes = data.get("prefixes", [])
     
-    if not key:
-        return jsonify({"error": "Key required for cache invalidation"}), 400
+    if not keys and not tags and not prefixes:
+        return jsonify({"error": "Key, tags or prefixes required for cache invalidation"}), 400
     
-    # Set cache with null value and 0 TTL to effectively invalidate
-    update_cache(key, None, ttl=0)
+    # The group first: if the cache service refuses it, nothing has been deleted yet
+    group = []
+    if tags or prefixes:
+        try:
+            group = cache_invalidate(tags, prefixes)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    deleted = cache_mdel(keys) + len(group)
+    keys = keys + group
     
     return jsonify({
         'status': 'Cache invalidated',
-        'key': key
+        'keys': keys,
+        'deleted': deleted
     })
 
 @app.route("/longtask", methods=["POST"])
@@ -198,5 +390,35 @@ def long_task():
         'task_id': f"task_{int(time.time())}"
     }), 202
 
+@app.route("/near-cache/invalidate", methods=["POST"])
+def invalidate_near_cache():
+    """Invalidation messages pushed by the cache service"""
+    data = request.json
+    if data.get("all"):
+        near_cache.clear()
+    else:
+        near_cache.invalidate(data.get("keys", []))
+    return jsonify({'status': 'ok'})
+
+@app.route("/near-cache/stats", methods=["GET"])
+def near_cache_stats():
+    return jsonify(near_cache.get_stats())
+
+def keep_subscribed(interval=10):
+    """Subscribe to the cache service invalidations, and again every interval seconds
+    to renew the lease (30 seconds) and in case the cache service restarted. The
+    near-cache is only used while subscribed."""
+    while True:
+        try:
+            requests.post(f"{cache_service}/cache/subscribe", json={"url": near_cache_url}, timeout=2).raise_for_status()
+            if not near_cache.enabled:
+                near_cache.set_enabled(True)
+        except requests.RequestException as e:
+            if near_cache.enabled:
+                print(f"Near-cache disabled, cannot subscribe to invalidations: {e}")
+                near_cache.set_enabled(False)
+        time.sleep(interval)
+
 if __name__ == "__main__":
+    Thread(target=keep_subscribed, daemon=True).start()
     app.run(port=service_port, debug=True)
@@ -1,97 +1,189 @@
 from flask import Flask, request, jsonify
+import os
 import time
 import threading
+import heapq
+from collections import OrderedDict
+
+from cache_common import (ENTRY_OVERHEAD, TcpBackend, compacted_heap, enable_snapshots, expiry_heap,
+                          purge_due, run_service, start_expiry_thread)
+from cache_entry import CacheEntry
+from cache_size import estimate_size
+from invalidation import InvalidationPublisher
+from cache_snapshot import restorable
 
 app = Flask(__name__)
 
 # Cache data structure with TTL support
 class CacheWithTTL:
     def __init__(self):
-        self.cache = {}
+        # Ordered from least to most recently used
+        self.cache = OrderedDict()
+        # Min-heap of (expiry, key); items that were overwritten or evicted are skipped lazily
+        self.expiry_heap = []
+        self.lock = threading.Lock()
         self.stats = {
             "hits": 0,
             "misses": 0,
             "expired": 0,
             "size": 0,
+            "bytes": 0,
             "evictions": 0
         }
-        self.max_size = 100  # Maximum number of items
-        self.cleanup_thread = threading.Thread(target=self._cleanup_expired_keys, daemon=True)
-        self.cleanup_thread.start()
+        self.max_bytes = 16 * 1024 * 1024  # Maximum estimated memory of the items
+        # Purges expired items when the next one is due, at least every 10 seconds
+        self.cleanup_thread = start_expiry_thread(self.purge_expired, 10)
     
     def get(self, key):
         """Get a value from cache, respecting TTL"""
-        if key not in self.cache:
-            self.stats["misses"] += 1
-            return None
-        
-        item = self.cache[key]
-        current_time = time.time()
-        
-        # Check if the item has expired
-        if item["expiry"] and item["expiry"] < current_time:
-            del self.cache[key]
-            self.stats["expired"] += 1
-            self.stats["size"] -= 1
-            return None
-        
-        # Update last accessed time for LRU implementation
-        item["last_accessed"] = current_time
-        self.stats["hits"] += 1
-        return item["value"]
+        with self.lock:
+            if key not in self.cache:
+                self.stats["misses"] += 1
+                return None
+            
+            item = self.cache[key]
+            current_time = time.time()
+            
+            # Check if the item has expired
+            if item.expiry and item.expiry < current_time:
+                self._remove(key)
+                self.stats["expired"] += 1
+                return None
+            
+            # Update last accessed time and move the item to the LRU tail
+            item.last_accessed = current_time
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return item.value
     
     def set(self, key, value, ttl=None):
         """Set a value in cache with optional TTL in seconds"""
         current_time = time.time()
         expiry = None if ttl is None else current_time + ttl
+        size = estimate_size(key, value, ENTRY_OVERHEAD)
         
-        # Check if we need to evict something
-        if key not in self.cache and len(self.cache) >= self.max_size:
+        with self.lock:
+            self._insert(key, CacheEntry(value, current_time, expiry, size))
+    
+    def _insert(self, key, item):
+        """Insert an item as the most recently used one, evicting to fit the byte budget"""
+        if key in self.cache:
+            self._remove(key)
+        
+        # An item larger than the whole cache is not stored
+        if item.size > self.max_bytes:
+            self.stats["evictions"] += 1
+            return
+        
+        # Evict until the new item fits in the byte budget
+        while self.stats["bytes"] + item.size > self.max_bytes:
             self._evict_lru()
         
-        # Update or insert the item
-        self.cache[key] = {
-            "value": value,
-            "created": current_time,
-            "last_accessed": current_time,
-            "expiry": expiry
-        }
+        self.cache[key] = item
+        self.stats["size"] += 1
+        self.stats["bytes"] += item.size
         
-        if key not in self.cache:
-            self.stats["size"] += 1
+        if item.expiry is not None:
+            heapq.heappush(self.expiry_heap, (item.expiry, key))
+            self.expiry_heap = compacted_heap(self.expiry_heap, self.cache)
+    
+    def snapshot(self):
+        """Items as (key, value, created, expiry, size) tuples, from least to most recently used"""
+        # Only the references are copied under the lock; items are never mutated
+        # in place except for last_accessed, which is not saved
+        with self.lock:
+            items = list(self.cache.items())
+        return [(key, item.value, item.created, item.expiry, item.size) for key, item in items]
+    
+    def restore(self, items):
+        """Replace the content of the cache with the items of a snapshot, skipping the
+        ones that expired meanwhile. Returns the number of items loaded."""
+        pairs, used = restorable(items, self.max_bytes)
+        with self.lock:
+            self.cache = OrderedDict(pairs)
+            self.expiry_heap = expiry_heap(self.cache)
+            self.stats["size"] = len(pairs)
+            self.stats["bytes"] = used
+        return len(pairs)
+    
+    def delete(self, key):
+        """Remove an item, returning whether it was cached"""
+        with self.lock:
+            if key not in self.cache:
+                return False
+            self._remove(key)
+            return True
+    
+    def delete_prefixes(self, prefixes):
+        """Remove the items whose key starts with any of the prefixes, returning their keys.
+        This cache keeps no index, so it scans every key."""
+        prefixes = tuple(prefixes)
+        with self.lock:
+            keys = [key for key in self.cache if key.startswith(prefixes)]
+            for key in keys:
+                self._remove(key)
+            return keys
+    
+    def flush(self):
+        """Remove every item"""
+        with self.lock:
+            self.cache.clear()
+            self.expiry_heap = []
+            self.stats["size"] = 0
+            self.stats["bytes"] = 0
+    
+    def _remove(self, key):
+        item = self.cache.pop(key)
+        self.stats["size"] -= 1
+        self.stats["bytes"] -= item.size
     
     def _evict_lru(self):
         """Evict the least recently used item"""
         if not self.cache:
             return
         
-        lru_key = min(self.cache.keys(), key=lambda k: self.cache[k]["last_accessed"])
-        del self.cache[lru_key]
+        self._remove(next(iter(self.cache)))
         self.stats["evictions"] += 1
-        self.stats["size"] -= 1
     
-    def _cleanup_expired_keys(self):
-        """Background thread to clean up expired keys"""
-        while True:
-            time.sleep(10)  # Check every 10 seconds
-            current_time = time.time()
-            expired_keys = [
-                k for k, v in self.cache.items() 
-                if v["expiry"] and v["expiry"] < current_time
-            ]
-            
-            for key in expired_keys:
-                del self.cache[key]
-                self.stats["expired"] += 1
-                self.stats["size"] -= 1
+    def purge_expired(self):
+        """Remove the items whose expiry is due, returning the next expiry time"""
+        with self.lock:
+            return purge_due(self.expiry_heap, self.cache, self._expire)
+    
+    def _expire(self, key):
+        self._remove(key)
+        self.stats["expired"] += 1
     
     def get_stats(self):
         """Return cache statistics"""
-        return self.stats
+        with self.lock:
+            return dict(self.stats)
 
 # Initialize cache
 cache_service = CacheWithTTL()
 
+# Gateways subscribe to the keys written or deleted here to keep their near-caches consistent
+invalidations = InvalidationPublisher()
+
+# Warm start from the last snapshot, which is refreshed periodically and on exit.
+# Set CACHE_SNAPSHOT_FILE to an empty string to disable snapshots.
+snapshot_file = os.environ.get("CACHE_SNAPSHOT_FILE", "cache.snapshot")
+snapshot_interval = float(os.environ.get("CACHE_SNAPSHOT_INTERVAL", 60))
+
+def tcp_get(key):
+    value = cache_service.get(key)
+    return value is not None, None, value
+
+def tcp_set(key, value, ttl, level, tags):
+    # This cache has a single level and keeps no tags
+    cache_service.set(key, value, ttl)
+
+tcp_backend = TcpBackend(tcp_get, tcp_set, cache_service.delete, invalidations)
+
+# Port of the binary protocol served next to the HTTP API, see cache_protocol.py.
+# Set CACHE_TCP_PORT to an empty string to disable it.
+tcp_port = os.environ.get("CACHE_TCP_PORT", "5014")
+
 @app.route("/cache/<key>", methods=["GET"])
 def get_cache(key):
     value = cache_service.get(key)
@@ -104,8 +196,60 @@ def set_cache(key):
     data = request.json
     ttl = data.get("ttl")  # Optional TTL in seconds
     cache_service.set(key, data.get("value"), ttl)
+    invalidations.publish([key])
     return jsonify({'status': 'ok'})
 
+@app.route("/cache/mget", methods=["POST"])
+def mget_cache():
+    keys = request.json.get("keys", [])
+    results = {}
+    for key in keys:
+        value = cache_service.get(key)
+        results[key] = {'value': value, 'hit': value is not None}
+    return jsonify({'results': results})
+
+@app.route("/cache/mset", methods=["POST"])
+def mset_cache():
+    items = request.json.get("items", [])
+    if not all("key" in item for item in items):
+        return jsonify({'error': 'Every item needs a key'}), 400
+    for item in items:
+        cache_service.set(item["key"], item.get("value"), item.get("ttl"))
+    invalidations.publish(item["key"] for item in items)
+    return jsonify({'status': 'ok', 'count': len(items)})
+
+@app.route("/cache/mdel", methods=["POST"])
+def mdel_cache():
+    keys = request.json.get("keys", [])
+    deleted = sum(cache_service.delete(key) for key in keys)
+    invalidations.publish(keys)
+    return jsonify({'status': 'ok', 'deleted': deleted})
+
+@app.route("/cache/invalidate", methods=["POST"])
+def invalidate_cache():
+    """Delete every key with any of the given key prefixes. Tags are not stored by this
+    cache, use multi_level_cache.py to invalidate by tag."""
+    data = request.json
+    if data.get("tags"):
+        return jsonify({'error': 'This cache does not keep tags, invalidate by prefixes'}), 400
+    prefixes = data.get("prefixes", [])
+    if not prefixes:
+        return jsonify({'error': 'prefixes required'}), 400
+    keys = cache_service.delete_prefixes(prefixes)
+    if keys:
+        invalidations.publish(keys)
+    return jsonify({'status': 'ok', 'deleted': len(keys), 'keys': keys})
+
+@app.route("/cache/subscribe", methods=["POST"])
+def subscribe():
+    """Register a URL that receives {"keys": [...]} whenever those keys change, for
+    the returned lease seconds unless it subscribes again"""
+    url = request.json.get("url")
+    if not url:
+        return jsonify({'error': 'url required'}), 400
+    lease = invalidations.subscribe(url)
+    return jsonify({'status': 'subscribed', 'lease': lease})
+
 @app.route("/cache/stats", methods=["GET"])
 def get_stats():
     stats = cache_service.get_stats()
@@ -116,14 +260,20 @@ def get_stats():
     return jsonify({
         "stats": stats,
         "hit_rate": f"{hit_rate:.2f}%",
-        "items": len(cache_service.cache)
+        "items": len(cache_service.cache),
+        "bytes": stats["bytes"],
+        "max_bytes": cache_service.max_bytes
     })
 
 @app.route("/cache/flush", methods=["POST"])
 def flush_cache():
-    cache_service.cache.clear()
-    cache_service.stats["size"] = 0
+    cache_service.flush()
+    invalidations.publish(None)
     return jsonify({'status': 'Cache flushed'})
 
 if __name__ == "__main__":
-    app.run(port=5004, debug=True)
+    snapshots = None
+    if snapshot_file:
+        snapshots = lambda: enable_snapshots(snapshot_file, snapshot_interval,
+                                             cache_service.snapshot, cache_service.restore)
+    run_service(app, 5004, snapshots, tcp_backend, tcp_port)
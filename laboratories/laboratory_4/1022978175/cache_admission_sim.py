@@ -0,0 +1,100 @@
+"""Hit-ratio comparison of the MultiLevelCache eviction policies.
+
+Replays a trace of cache lookups through a read-through MultiLevelCache (a
+miss is followed by set(level="all"), as the gateway does) once with plain
+LRU levels and once with W-TinyLFU levels, and reports the hit ratio of each
+level and of the whole cache. Cached values have the shape of the gateway
+responses. By default the trace is replayed with two sets of level byte
+budgets: the service defaults (256 KiB, 2 MiB and 16 MiB) and small
+budgets of 10, 50 and 200 KiB, where the keys do not fit in the cache.
+The best possible total is the share of lookups that are not the first
+lookup of their key.
+
+A trace is a file with one key per line. The cache service records one when
+started with CACHE_TRACE_FILE set:
+
+    CACHE_TRACE_FILE=gateway.trace python multi_level_cache.py
+
+Without --trace a synthetic gateway trace is generated: "my_data" and
+"complex_data_<id>" lookups with Zipf-distributed ids, interrupted by scans
+of ids that are requested only once.
+
+Usage: python cache_admission_sim.py [--trace gateway.trace] [--requests 200000]
+                                    [--level-bytes 262144 2097152 16777216]
+"""
+import argparse
+import random
+import time
+
+from multi_level_cache import MultiLevelCache
+
+# Level byte budgets replayed when --level-bytes is not given
+BUDGETS = {
+    "service defaults": [256 * 1024, 2 * 1024 * 1024, 16 * 1024 * 1024],
+    "small": [10 * 1024, 50 * 1024, 200 * 1024],
+}
+
+
+def synthetic_trace(requests, ids=5000, zipf_s=0.9, scan_every=2000, scan_length=300, seed=42):
+    rng = random.Random(seed)
+    weights = [1 / rank ** zipf_s for rank in range(1, ids + 1)]
+    popular = rng.choices(range(1, ids + 1), weights=weights, k=requests)
+    trace = []
+    scanned = ids
+    for i, id_ in enumerate(popular):
+        if i % scan_every == scan_every - 1:
+            trace.extend(f"complex_data_{scanned + n}" for n in range(scan_length))
+            scanned += scan_length
+        trace.append("my_data" if id_ == 1 else f"complex_data_{id_}")
+    return trace
+
+
+def gateway_value(key):
+    """A value shaped like the ones the gateway caches for the key"""
+    if key == "my_data":
+        return "Fetched fresh data from DB"
+    return {
+        "db_data": "Fetched fresh data from DB",
+        "service_data": "Processed data from microservice",
+        "timestamp": time.time()
+    }
+
+
+def replay(trace, policy, level_bytes):
+    l1_bytes, l2_bytes, l3_bytes = level_bytes
+    cache = MultiLevelCache(policy=policy, l1_bytes=l1_bytes, l2_bytes=l2_bytes, l3_bytes=l3_bytes)
+    hits = {"L1": 0, "L2": 0, "L3": 0}
+    for key in trace:
+        result = cache.get(key)
+        if result["hit"]:
+            hits[result["level"]] += 1
+        else:
+            cache.set(key, gateway_value(key))
+    return hits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare LRU and W-TinyLFU hit ratios on a cache trace")
+    parser.add_argument("--trace", help="File with one looked up key per line")
+    parser.add_argument("--requests", type=int, default=200000, help="Length of the synthetic trace")
+    parser.add_argument("--level-bytes", type=int, nargs=3, metavar=("L1", "L2", "L3"),
+                        help="Byte budget of each level (default: the service defaults and small budgets)")
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as f:
+            trace = [line.strip() for line in f if line.strip()]
+    else:
+        trace = synthetic_trace(args.requests)
+
+    budgets = {"--level-bytes": args.level_bytes} if args.level_bytes else BUDGETS
+    distinct = len(set(trace))
+    print(f"{len(trace):,} lookups, {distinct:,} distinct keys, "
+          f"best possible total {1 - distinct / len(trace):.1%}")
+    for name, level_bytes in budgets.items():
+        print(f"\n{name}: " + " / ".join(f"{size / 1024:,.0f} KiB" for size in level_bytes))
+        print(f"{'policy':>8} {'L1':>8} {'L2':>8} {'L3':>8} {'total':>8}")
+        for policy in ["lru", "tinylfu"]:
+            hits = replay(trace, policy, level_bytes)
+            ratios = [hits[level] / len(trace) for level in ["L1", "L2", "L3"]]
+            print(f"{policy:>8} " + " ".join(f"{ratio:>8.1%}" for ratio in ratios) + f" {sum(ratios):>8.1%}")
@@ -0,0 +1,62 @@
+"""Micro-benchmark for the in-process cache structures.
+
+Measures get and set throughput (ops/sec) of CacheLevel and CacheWithTTL
+when they hold 10^3 to 10^6 entries. The caches get a byte budget that fits
+that many entries; sets use new keys on a full cache, so every set also
+evicts the least recently used entry.
+
+Usage: python cache_benchmark.py [--ops 100000] [--max-exp 6]
+"""
+import argparse
+import random
+import time
+
+from cache import CacheWithTTL
+from cache_common import ENTRY_OVERHEAD
+from cache_size import estimate_size
+from multi_level_cache import CacheLevel
+
+
+def make_cache_level(size):
+    return CacheLevel("bench", max_bytes=size * estimate_size(f"key{size}", size, ENTRY_OVERHEAD))
+
+
+def make_cache_with_ttl(size):
+    cache = CacheWithTTL()
+    cache.max_bytes = size * estimate_size(f"key{size}", size, ENTRY_OVERHEAD)
+    return cache
+
+
+def ops_per_sec(operation, keys):
+    start = time.perf_counter()
+    for key in keys:
+        operation(key)
+    return len(keys) / (time.perf_counter() - start)
+
+
+def run_benchmark(name, make_cache, sizes, ops):
+    print(f"\n{name}")
+    print(f"{'entries':>10} {'get ops/s':>14} {'set+evict ops/s':>16}")
+    for size in sizes:
+        cache = make_cache(size)
+        for i in range(size):
+            cache.set(f"key{i}", i)
+
+        hit_keys = [f"key{random.randrange(size)}" for _ in range(ops)]
+        get_rate = ops_per_sec(cache.get, hit_keys)
+
+        new_keys = [f"new{i}" for i in range(ops)]
+        set_rate = ops_per_sec(lambda key: cache.set(key, 0), new_keys)
+
+        print(f"{size:>10} {get_rate:>14,.0f} {set_rate:>16,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache micro-benchmark")
+    parser.add_argument("--ops", type=int, default=100000, help="Operations measured per size")
+    parser.add_argument("--max-exp", type=int, default=6, help="Largest cache size as a power of ten")
+    args = parser.parse_args()
+
+    sizes = [10 ** exp for exp in range(3, args.max_exp + 1)]
+    run_benchmark("CacheLevel (multi_level_cache.py)", make_cache_level, sizes, args.ops)
+    run_benchmark("CacheWithTTL (cache.py)", make_cache_with_ttl, sizes, args.ops)
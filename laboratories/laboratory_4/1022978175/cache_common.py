@@ -0,0 +1,102 @@
+"""Pieces shared by the two cache services, cache.py and multi_level_cache.py"""
+import atexit
+import heapq
+import os
+import threading
+import time
+
+from cache_snapshot import gc_paused, load_snapshot, save_snapshot, start_snapshots
+from cache_tcp_server import serve_tcp
+
+# Estimated bytes per entry besides its key and value: the CacheEntry, its
+# timestamps, the LRU links and the expiry heap item
+ENTRY_OVERHEAD = 350
+
+
+def expiry_heap(entries):
+    """Min-heap of (expiry, key) for the entries (a key -> CacheEntry mapping) that expire"""
+    heap = [(entry.expiry, key) for key, entry in entries.items() if entry.expiry is not None]
+    heapq.heapify(heap)
+    return heap
+
+
+def compacted_heap(heap, entries):
+    """The heap, rebuilt from the live entries once its stale items outnumber them"""
+    if len(heap) > 2 * len(entries) + 64:
+        return expiry_heap(entries)
+    return heap
+
+
+def purge_due(heap, entries, remove, now=None):
+    """Pop the heap items that are due and call remove(key) for the entries they still
+    describe, touching only those entries. Items left behind by an overwrite, eviction
+    or lazy expiration are skipped. Returns the next expiry time, or None."""
+    now = time.time() if now is None else now
+    while heap and heap[0][0] < now:
+        expiry, key = heapq.heappop(heap)
+        entry = entries.get(key)
+        if entry is not None and entry.expiry == expiry:
+            remove(key)
+    return heap[0][0] if heap else None
+
+
+def start_expiry_thread(purge, max_delay):
+    """Call purge() from a background thread, waking up when the next entry is due
+    (purge returns its expiry time, or None) and at least every max_delay seconds"""
+    def expiry_loop():
+        while True:
+            next_expiry = purge()
+            delay = max_delay
+            if next_expiry is not None:
+                # Wait at least a second so expirations close in time are purged together
+                delay = min(delay, max(1, next_expiry - time.time()))
+            time.sleep(delay)
+
+    thread = threading.Thread(target=expiry_loop, daemon=True)
+    thread.start()
+    return thread
+
+
+def enable_snapshots(path, interval, take_snapshot, restore):
+    """Warm start from the snapshot at path with restore(data), which returns the number
+    of entries loaded, then save take_snapshot() every interval seconds and on exit"""
+    start = time.time()
+    with gc_paused():
+        data = load_snapshot(path)
+        if data is not None:
+            loaded = restore(data)
+            print(f"Restored {loaded} cached entries from {path} in {time.time() - start:.2f}s")
+    start_snapshots(take_snapshot, path, interval)
+    atexit.register(lambda: save_snapshot(path, take_snapshot()))
+
+
+class TcpBackend:
+    """Operations of the binary protocol, with the same effects as the HTTP routes: the
+    keys written or deleted are published to the near-caches. get(key) returns
+    (hit, level, value), set takes (key, value, ttl, level, tags) and delete(key)
+    returns whether the key was cached."""
+    def __init__(self, get, set, delete, invalidations):
+        self.get = get
+        self._set = set
+        self._delete = delete
+        self.invalidations = invalidations
+
+    def set(self, key, value, ttl, level, tags):
+        self._set(key, value, ttl, level, tags)
+        self.invalidations.publish([key])
+
+    def delete(self, key):
+        deleted = self._delete(key)
+        self.invalidations.publish([key])
+        return deleted
+
+
+def run_service(app, port, snapshots=None, tcp_backend=None, tcp_port=None):
+    """Run a cache service on the Flask debug server. The reloader serves requests from a
+    child process; only that one calls snapshots() and serves the binary protocol."""
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        if snapshots:
+            snapshots()
+        if tcp_port:
+            serve_tcp(tcp_backend, int(tcp_port))
+    app.run(port=port, debug=True)
@@ -0,0 +1,12 @@
+class CacheEntry:
+    """Value and metadata of a cached key. __slots__ stores the fields in a fixed
+    layout instead of a per-entry dict, which matters with millions of entries."""
+    __slots__ = ("value", "created", "last_accessed", "access_count", "expiry", "size")
+    
+    def __init__(self, value, created, expiry, size):
+        self.value = value
+        self.created = created
+        self.last_accessed = created
+        self.access_count = 0
+        self.expiry = expiry
+        self.size = size
@@ -0,0 +1,89 @@
+"""Compares the CacheEntry __slots__ class with the dict entries it replaced.
+
+For each representation it reports:
+
+- bytes per entry: memory allocated for the entry and its timestamps,
+  measured with tracemalloc over --entries entries (keys and values excluded)
+- set ops/s: building an entry, as CacheLevel.set does
+- get ops/s: the expiry check and access bookkeeping of CacheLevel.get
+
+Usage: python cache_entry_benchmark.py [--entries 1000000] [--ops 1000000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from cache_entry import CacheEntry
+
+
+def make_dict_entry(value, created, expiry, size):
+    return {
+        "value": value,
+        "created": created,
+        "last_accessed": created,
+        "access_count": 0,
+        "expiry": expiry,
+        "size": size
+    }
+
+
+def get_dict_entry(entry, current_time):
+    if entry["expiry"] and entry["expiry"] < current_time:
+        return None
+    entry["last_accessed"] = current_time
+    entry["access_count"] += 1
+    return entry["value"]
+
+
+def get_slots_entry(entry, current_time):
+    if entry.expiry and entry.expiry < current_time:
+        return None
+    entry.last_accessed = current_time
+    entry.access_count += 1
+    return entry.value
+
+
+def bytes_per_entry(make_entry, entries):
+    now = time.time()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [make_entry(None, now + i, now + i + 60, 1000) for i in range(entries)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # The list holding the entries is not part of the entry cost
+    used -= 8 * len(kept)
+    return used / entries
+
+
+def ops_per_sec(operation, ops):
+    start = time.perf_counter()
+    operation(ops)
+    return ops / (time.perf_counter() - start)
+
+
+def run(name, make_entry, get_entry, entries, ops):
+    now = time.time()
+
+    def do_sets(count):
+        for i in range(count):
+            make_entry(None, now, now + 60, 1000)
+
+    entry = make_entry(None, now, now + 60, 1000)
+
+    def do_gets(count):
+        for _ in range(count):
+            get_entry(entry, now)
+
+    size = bytes_per_entry(make_entry, entries)
+    print(f"{name:<22} {size:>14,.0f} {ops_per_sec(do_sets, ops):>14,.0f} {ops_per_sec(do_gets, ops):>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache entry representation benchmark")
+    parser.add_argument("--entries", type=int, default=1000000, help="Entries allocated to measure memory")
+    parser.add_argument("--ops", type=int, default=1000000, help="Operations measured for get and set")
+    args = parser.parse_args()
+
+    print(f"{'entry':<22} {'bytes/entry':>14} {'set ops/s':>14} {'get ops/s':>14}")
+    run("dict", make_dict_entry, get_dict_entry, args.entries, args.ops)
+    run("CacheEntry (__slots__)", CacheEntry, get_slots_entry, args.entries, args.ops)
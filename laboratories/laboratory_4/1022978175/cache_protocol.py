@@ -0,0 +1,211 @@
+"""Compact binary TCP protocol for the cache services, and its client.
+
+Every request and response is a frame: a header with the body length (4 bytes),
+a request id (4 bytes) and an opcode or status (1 byte), then the body. Values
+travel as compact JSON, the rest as binary fields. Clients can pipeline: send
+several frames and then read the responses, which come back in the same order.
+
+  GET     body: key                        -> OK: level (1 byte) + value | MISS
+  SET     body: ttl (double, NaN for the default), level (1 byte),
+                key length (2 bytes), tags length (2 bytes),
+                key, tags separated by NUL, value   -> OK
+  DELETE  body: key                        -> OK if it was cached | MISS
+"""
+import json
+import math
+import queue
+import socket
+import struct
+from contextlib import contextmanager
+
+HEADER = struct.Struct("!IIB")
+SET_HEADER = struct.Struct("!dBHH")
+MAX_FRAME = 64 * 1024 * 1024
+# Requests sent before reading their responses. Bounded so neither side blocks
+# writing to a peer that is itself blocked writing instead of reading.
+PIPELINE_WINDOW = 64
+
+OP_GET = 1
+OP_SET = 2
+OP_DELETE = 3
+
+STATUS_OK = 0
+STATUS_MISS = 1
+STATUS_ERROR = 2
+
+# Level names by their number on the wire
+LEVELS = ["all", "L1", "L2", "L3"]
+
+
+class CacheProtocolError(Exception):
+    pass
+
+
+def encode_value(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def decode_value(data):
+    return json.loads(data)
+
+
+def encode_frame(request_id, code, body=b""):
+    return HEADER.pack(len(body), request_id, code) + body
+
+
+def encode_set(key, value, ttl=None, level="all", tags=None):
+    if level not in LEVELS:
+        raise ValueError(f"Unknown cache level {level!r}, expected one of {', '.join(LEVELS)}")
+    key = key.encode()
+    tags = "\0".join(tags or ()).encode()
+    return (SET_HEADER.pack(math.nan if ttl is None else ttl, LEVELS.index(level), len(key), len(tags))
+            + key + tags + encode_value(value))
+
+
+def decode_set(body):
+    """Return key, value, ttl, level and tags of a SET body"""
+    ttl, level, key_length, tags_length = SET_HEADER.unpack_from(body)
+    start = SET_HEADER.size
+    key = body[start:start + key_length].decode()
+    start += key_length
+    tags = body[start:start + tags_length].decode()
+    start += tags_length
+    return (key, decode_value(body[start:]), None if math.isnan(ttl) else ttl,
+            LEVELS[level], tags.split("\0") if tags else None)
+
+
+def split_frames(buffer):
+    """Remove the complete frames at the start of buffer (a bytearray) and return them
+    as (request_id, code, body) tuples; an incomplete frame is left in the buffer"""
+    frames = []
+    start = 0
+    while len(buffer) - start >= HEADER.size:
+        length, request_id, code = HEADER.unpack_from(buffer, start)
+        if length > MAX_FRAME:
+            raise CacheProtocolError(f"Frame of {length} bytes is too large")
+        end = start + HEADER.size + length
+        if len(buffer) < end:
+            break
+        frames.append((request_id, code, bytes(buffer[start + HEADER.size:end])))
+        start = end
+    del buffer[:start]
+    return frames
+
+
+class _Connection:
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+        self.next_id = 0
+
+    def request(self, requests):
+        """Send (opcode, body) requests, pipelined, and return their (status, body) responses"""
+        responses = []
+        for start in range(0, len(requests), PIPELINE_WINDOW):
+            responses.extend(self._request_window(requests[start:start + PIPELINE_WINDOW]))
+        return responses
+
+    def _request_window(self, requests):
+        first_id = self.next_id
+        self.next_id = (self.next_id + len(requests)) % 2 ** 32
+        self.sock.sendall(b"".join(encode_frame((first_id + i) % 2 ** 32, op, body)
+                                   for i, (op, body) in enumerate(requests)))
+
+        responses = []
+        while len(responses) < len(requests):
+            frames = split_frames(self.buffer)
+            if not frames:
+                chunk = self.sock.recv(65536)
+                if not chunk:
+                    raise ConnectionError("Cache server closed the connection")
+                self.buffer += chunk
+                continue
+            for request_id, status, body in frames:
+                if request_id != (first_id + len(responses)) % 2 ** 32:
+                    raise CacheProtocolError(f"Unexpected response id {request_id}")
+                if status == STATUS_ERROR:
+                    raise CacheProtocolError(body.decode())
+                responses.append((status, body))
+        return responses
+
+    def close(self):
+        self.sock.close()
+
+
+class CacheClient:
+    """Client of the binary cache protocol with a pool of persistent connections, safe
+    to share between threads. Results have the same shape as the HTTP API's."""
+    def __init__(self, host, port, timeout=2.0, pool_size=16):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    @contextmanager
+    def _connection(self):
+        try:
+            connection = self.pool.get_nowait()
+        except queue.Empty:
+            connection = _Connection(self.host, self.port, self.timeout)
+        try:
+            yield connection
+        except BaseException:
+            # The stream may be left in the middle of a response
+            connection.close()
+            raise
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _request(self, requests):
+        with self._connection() as connection:
+            return connection.request(requests)
+
+    @staticmethod
+    def _get_result(status, body):
+        if status != STATUS_OK:
+            return {"value": None, "hit": False}
+        result = {"value": decode_value(body[1:]), "hit": True}
+        if body[0]:
+            result["level"] = LEVELS[body[0]]
+        return result
+
+    def get(self, key):
+        return self._get_result(*self._request([(OP_GET, key.encode())])[0])
+
+    def set(self, key, value, ttl=None, level="all", tags=None):
+        self._request([(OP_SET, encode_set(key, value, ttl, level, tags))])
+
+    def delete(self, key):
+        """Delete a key, returning whether it was cached"""
+        return self._request([(OP_DELETE, key.encode())])[0][0] == STATUS_OK
+
+    def mget(self, keys):
+        """Get several keys with pipelined requests, as {key: result}"""
+        if not keys:
+            return {}
+        responses = self._request([(OP_GET, key.encode()) for key in keys])
+        return {key: self._get_result(*response) for key, response in zip(keys, responses)}
+
+    def mset(self, items):
+        """Set several items (dicts with key, value and optionally ttl, level and tags)"""
+        if items:
+            self._request([(OP_SET, encode_set(item["key"], item.get("value"), item.get("ttl"),
+                                               item.get("level", "all"), item.get("tags")))
+                           for item in items])
+
+    def mdel(self, keys):
+        """Delete several keys, returning how many were cached"""
+        if not keys:
+            return 0
+        responses = self._request([(OP_DELETE, key.encode()) for key in keys])
+        return sum(status == STATUS_OK for status, _ in responses)
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
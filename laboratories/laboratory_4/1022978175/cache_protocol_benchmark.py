@@ -0,0 +1,133 @@
+"""Benchmark of the cache service HTTP/JSON API against its binary TCP protocol.
+
+Starts the multi-level cache service in a separate process, serving HTTP and
+the binary protocol on test ports, then runs the same workload (90% gets, 10%
+sets of small JSON values over --keys keys) from --clients concurrent client
+processes with each transport:
+  - http:          requests.Session with keep-alive, one request per operation
+  - tcp:           CacheClient, one round trip per operation
+  - tcp-pipelined: CacheClient.mget, --batch gets per round trip
+
+Usage: python cache_protocol_benchmark.py [--clients 1 8 32] [--ops 2000] [--batch 16]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+HTTP_PORT = 15104
+TCP_PORT = 15114
+
+
+def serve():
+    """Run the cache service on the test ports until killed"""
+    os.environ["CACHE_SNAPSHOT_FILE"] = ""
+    import multi_level_cache
+    from cache_tcp_server import serve_tcp
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    serve_tcp(multi_level_cache.tcp_backend, TCP_PORT)
+    make_server("127.0.0.1", HTTP_PORT, multi_level_cache.app, threaded=True).serve_forever()
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Cache service did not start on port {port}")
+
+
+def run_client(args):
+    """Run ops operations and return (start, end, operations, latencies of each call)"""
+    mode, ops, keys, batch, seed = args
+    from cache_protocol import CacheClient
+
+    rng = random.Random(seed)
+    value = {"data": "x" * 100, "fresh_until": time.time() + 3600, "load_time": 0.1}
+    latencies = []
+    if mode == "http":
+        session = requests.Session()
+        base = f"http://127.0.0.1:{HTTP_PORT}/cache"
+    else:
+        client = CacheClient("127.0.0.1", TCP_PORT, pool_size=1)
+
+    start = time.perf_counter()
+    done = 0
+    while done < ops:
+        call_start = time.perf_counter()
+        if mode == "tcp-pipelined":
+            client.mget([f"key:{rng.randrange(keys)}" for _ in range(batch)])
+            done += batch
+        else:
+            key = f"key:{rng.randrange(keys)}"
+            if rng.random() < 0.1:
+                if mode == "http":
+                    session.post(f"{base}/{key}", json={"value": value}).raise_for_status()
+                else:
+                    client.set(key, value)
+            elif mode == "http":
+                session.get(f"{base}/{key}").raise_for_status()
+            else:
+                client.get(key)
+            done += 1
+        latencies.append(time.perf_counter() - call_start)
+    return start, time.perf_counter(), done, latencies
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON vs binary TCP protocol for the cache service")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--ops", type=int, default=2000, help="operations per client")
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=16, help="gets per pipelined round trip")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve()
+        return
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"])
+    try:
+        wait_for_port(HTTP_PORT)
+        wait_for_port(TCP_PORT)
+        # Fill the keys so the gets hit
+        from cache_protocol import CacheClient
+        CacheClient("127.0.0.1", TCP_PORT).mset(
+            [{"key": f"key:{i}", "value": {"data": "x" * 100}} for i in range(args.keys)])
+
+        print(f"{'clients':>7} {'transport':<14} {'ops/s':>10} {'p50 ms/call':>12} {'p99 ms/call':>12}")
+        for clients in args.clients:
+            for mode in ["http", "tcp", "tcp-pipelined"]:
+                with multiprocessing.Pool(clients) as pool:
+                    results = pool.map(run_client, [(mode, args.ops, args.keys, args.batch, seed)
+                                                    for seed in range(clients)])
+                elapsed = max(r[1] for r in results) - min(r[0] for r in results)
+                operations = sum(r[2] for r in results)
+                latencies = [latency for r in results for latency in r[3]]
+                print(f"{clients:>7} {mode:<14} {operations / elapsed:>10,.0f} "
+                      f"{percentile(latencies, 0.5) * 1000:>12.2f} {percentile(latencies, 0.99) * 1000:>12.2f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import sys
+
+
+def deep_sizeof(value):
+    """Estimate the memory used by a JSON-like value, including its contents.
+    Shared objects (small ints, interned strings) are counted every time they appear."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_sizeof(item) for item in value)
+    return size
+
+
+def estimate_size(key, value, overhead=0):
+    """Estimated bytes of a cache entry: its key, its value and the per-entry overhead of the cache"""
+    return deep_sizeof(key) + deep_sizeof(value) + overhead
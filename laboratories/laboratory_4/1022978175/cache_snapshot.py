@@ -0,0 +1,102 @@
+import gc
+import os
+import pickle
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from cache_entry import CacheEntry
+
+SNAPSHOT_VERSION = 1
+
+# The periodic thread and the save on exit may write the same snapshot at once
+_save_lock = threading.Lock()
+
+
+@contextmanager
+def gc_paused():
+    """Pause the cyclic garbage collector while millions of acyclic objects are
+    created, which otherwise triggers full collections over and over"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def restorable(items, budget):
+    """Turn snapshot items (key, value, created, expiry, size), ordered from the first
+    to the last to evict, into (key, CacheEntry) pairs in the same order. Expired items
+    are skipped and only the last items that fit in budget bytes are kept.
+    Returns the pairs and the bytes they use."""
+    current_time = time.time()
+    pairs = []
+    used = 0
+    for key, value, created, expiry, size in reversed(items):
+        if expiry is not None and expiry < current_time:
+            continue
+        if used + size > budget:
+            break
+        used += size
+        pairs.append((key, CacheEntry(value, created, expiry, size)))
+    pairs.reverse()
+    return pairs, used
+
+
+def save_snapshot(path, data):
+    """Write the snapshot data to path, replacing the previous snapshot atomically"""
+    # Write to a temporary file first so a crash never leaves a partial snapshot behind.
+    # mkstemp gives every save its own file, even within the same process.
+    with _save_lock:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                        prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump({"version": SNAPSHOT_VERSION, "saved": time.time(), "data": data}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+def load_snapshot(path):
+    """Return the data of the snapshot at path, or None when there is no usable snapshot"""
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        print(f"Ignoring unreadable cache snapshot {path}: {e}")
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        print(f"Ignoring cache snapshot {path} with an unknown format")
+        return None
+    return snapshot["data"]
+
+
+def start_snapshots(take_snapshot, path, interval):
+    """Save take_snapshot() to path every interval seconds from a background thread.
+    take_snapshot should only copy references under the cache locks; the
+    serialization and the file write happen here, outside of them."""
+    def snapshot_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with gc_paused():
+                    data = take_snapshot()
+                save_snapshot(path, data)
+            except OSError as e:
+                print(f"Cache snapshot to {path} failed: {e}")
+
+    thread = threading.Thread(target=snapshot_loop, daemon=True)
+    thread.start()
+    return thread
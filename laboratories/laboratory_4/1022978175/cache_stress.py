@@ -0,0 +1,87 @@
+"""Concurrency stress test for MultiLevelCache.
+
+Each worker thread owns a set of keys and writes increasing versions of them
+to every level, while reading random keys owned by all workers. The run fails
+if:
+
+- a reader sees a key go back to an older version after a newer one, which
+  happens when a promotion between levels overwrites a concurrent set, or
+- the merged stats counters do not add up to the operations performed,
+  which happens when counter updates are lost.
+
+Usage: python cache_stress.py [--threads 1 2 4 8 16] [--ops 20000]
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+from multi_level_cache import MultiLevelCache
+
+KEYS_PER_THREAD = 40
+
+
+def run(threads, ops):
+    cache = MultiLevelCache()
+    keys = [f"t{t}_k{k}" for t in range(threads) for k in range(KEYS_PER_THREAD)]
+    errors = []
+    gets = [0] * threads
+    sets = [0] * threads
+
+    def worker(index):
+        own_keys = keys[index * KEYS_PER_THREAD:(index + 1) * KEYS_PER_THREAD]
+        versions = dict.fromkeys(own_keys, 0)
+        seen = {}
+        rng = random.Random(index)
+        for _ in range(ops):
+            if rng.random() < 0.3:
+                key = rng.choice(own_keys)
+                versions[key] += 1
+                cache.set(key, versions[key])
+                sets[index] += 1
+            else:
+                key = rng.choice(keys)
+                version = cache.get(key)["value"]
+                gets[index] += 1
+                if version is not None:
+                    if version < seen.get(key, 0):
+                        errors.append(f"{key} went back from version {seen[key]} to {version}")
+                    seen[key] = max(seen.get(key, 0), version)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    # Every get reaches L1 and every set writes all three levels
+    stats = cache.get_stats()
+    l1 = stats["L1"]
+    if l1["hits"] + l1["misses"] + l1["expirations"] != sum(gets):
+        errors.append(f"L1 lookups {l1['hits'] + l1['misses'] + l1['expirations']} != gets {sum(gets)}")
+    for level in ["L1", "L2", "L3"]:
+        promotions = stats["L2"]["hits"] if level == "L1" else stats["L3"]["hits"] if level == "L2" else 0
+        if stats[level]["sets"] != sum(sets) + promotions:
+            errors.append(f"{level} sets {stats[level]['sets']} != {sum(sets) + promotions}")
+
+    return (sum(gets) + sum(sets)) / elapsed, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MultiLevelCache concurrency stress test")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--ops", type=int, default=20000, help="Operations per thread")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'threads':>8} {'ops/s':>12} {'result':>8}")
+    for threads in args.threads:
+        rate, errors = run(threads, args.ops)
+        print(f"{threads:>8} {rate:>12,.0f} {'FAIL' if errors else 'ok':>8}")
+        for error in errors[:10]:
+            print(f"    {error}")
+        failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,69 @@
+import socket
+import socketserver
+import threading
+
+from cache_protocol import (LEVELS, OP_DELETE, OP_GET, OP_SET, STATUS_ERROR, STATUS_MISS, STATUS_OK,
+                            CacheProtocolError, decode_set, encode_frame, encode_value, split_frames)
+
+
+class CacheRequestHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection. All the complete frames received in one read are
+    processed in order and answered with a single write, so pipelined requests share
+    the system calls."""
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        buffer = bytearray()
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+            try:
+                frames = split_frames(buffer)
+            except CacheProtocolError as e:
+                self.request.sendall(encode_frame(0, STATUS_ERROR, str(e).encode()))
+                return
+            if frames:
+                self.request.sendall(b"".join(self.respond(*frame) for frame in frames))
+
+    def respond(self, request_id, op, body):
+        backend = self.server.backend
+        try:
+            if op == OP_GET:
+                hit, level, value = backend.get(body.decode())
+                if not hit:
+                    return encode_frame(request_id, STATUS_MISS)
+                level = LEVELS.index(level) if level in LEVELS else 0
+                return encode_frame(request_id, STATUS_OK, bytes([level]) + encode_value(value))
+            if op == OP_SET:
+                backend.set(*decode_set(body))
+                return encode_frame(request_id, STATUS_OK)
+            if op == OP_DELETE:
+                return encode_frame(request_id, STATUS_OK if backend.delete(body.decode()) else STATUS_MISS)
+            return encode_frame(request_id, STATUS_ERROR, f"Unknown opcode {op}".encode())
+        except Exception as e:
+            # Answer the error and keep serving the connection
+            return encode_frame(request_id, STATUS_ERROR, f"{type(e).__name__}: {e}".encode())
+
+
+class CacheTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, backend):
+        super().__init__(address, CacheRequestHandler)
+        self.backend = backend
+
+
+def serve_tcp(backend, port, host="127.0.0.1"):
+    """Serve the binary cache protocol from a background thread. backend provides
+    get(key) -> (hit, level, value), set(key, value, ttl, level, tags) and
+    delete(key) -> whether it was cached."""
+    server = CacheTCPServer((host, port), backend)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,134 @@
+"""Load test for the request coalescing (single-flight) in the API gateway.
+
+Starts the multi-level cache service, a stub database and microservice that
+count their calls, and the API gateway, all in this process on test ports.
+Each burst deletes the key from the cache and fires --concurrency requests
+at once at a gateway endpoint, so they all miss. The backend calls per
+burst are reported with and without coalescing.
+
+Usage: python coalescing_load_test.py [--bursts 5] [--concurrency 20]
+"""
+import argparse
+import contextlib
+import io
+import logging
+import threading
+
+import jwt
+import requests
+from flask import Flask, jsonify
+from werkzeug.serving import make_server
+
+import api_gateway
+import multi_level_cache
+
+CACHE_PORT = 15004
+DATABASE_PORT = 15002
+MICROSERVICE_PORT = 15001
+GATEWAY_PORT = 15000
+
+backend_calls = {"db": 0, "process": 0}
+calls_lock = threading.Lock()
+
+
+def count_call(name):
+    with calls_lock:
+        backend_calls[name] += 1
+
+
+def create_backend():
+    backend = Flask(__name__)
+
+    @backend.route("/db")
+    def db():
+        count_call("db")
+        return jsonify({'message': 'Fetched fresh data from DB'})
+
+    @backend.route("/process")
+    def process():
+        count_call("process")
+        return jsonify({'message': 'Processed data from microservice'})
+
+    return backend
+
+
+def serve(app, port):
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class NoCoalescing:
+    """Stand-in for SingleFlight that lets every caller run its own loader"""
+    def do(self, key, loader):
+        return loader(), False
+
+    def running(self, key):
+        return False
+
+
+def run_burst(path, cache_key, concurrency, token):
+    requests.post(f"http://127.0.0.1:{CACHE_PORT}/cache/mdel", json={"keys": [cache_key]})
+    with calls_lock:
+        before = dict(backend_calls)
+
+    barrier = threading.Barrier(concurrency)
+    responses = []
+
+    def client():
+        barrier.wait()
+        response = requests.get(f"http://127.0.0.1:{GATEWAY_PORT}{path}", headers={"Authorization": token})
+        responses.append(response.json())
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+
+    with calls_lock:
+        calls = {name: backend_calls[name] - before[name] for name in backend_calls}
+    misses = sum(1 for r in responses if not r.get("cached"))
+    return calls, misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-flight load test for the API gateway")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    api_gateway.cache_service = f"http://127.0.0.1:{CACHE_PORT}"
+    api_gateway.database_service = f"http://127.0.0.1:{DATABASE_PORT}"
+    api_gateway.microservice = f"http://127.0.0.1:{MICROSERVICE_PORT}"
+    servers = [
+        serve(multi_level_cache.app, CACHE_PORT),
+        serve(create_backend(), DATABASE_PORT),
+        serve(create_backend(), MICROSERVICE_PORT),
+        serve(api_gateway.app, GATEWAY_PORT),
+    ]
+    token = jwt.encode({}, api_gateway.SECRET_KEY, algorithm="HS256")
+    # Keep the request logs and the gateway prints out of the report
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    print(f"{'endpoint':<22} {'coalescing':>10} {'misses/burst':>13} {'db calls/burst':>15} {'process calls/burst':>20}")
+    for coalescing in [False, True]:
+        api_gateway.loads = api_gateway.SingleFlight() if coalescing else NoCoalescing()
+        for path, cache_key in [("/data", "my_data"), ("/data/complex?id=7", "complex_data_7")]:
+            totals = {"db": 0, "process": 0}
+            total_misses = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(args.bursts):
+                    calls, misses = run_burst(path, cache_key, args.concurrency, token)
+                    total_misses += misses
+                    for name in totals:
+                        totals[name] += calls[name]
+            print(f"{path:<22} {'on' if coalescing else 'off':>10} {total_misses / args.bursts:>13.1f} "
+                  f"{totals['db'] / args.bursts:>15.1f} {totals['process'] / args.bursts:>20.1f}")
+
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
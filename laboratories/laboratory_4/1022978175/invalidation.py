@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+
+import requests
+
+
+class InvalidationPublisher:
+    """Pushes the keys written or deleted in the cache service to the subscribed
+    gateways as {"keys": [...]}, or {"all": true} after a flush, so they drop them
+    from their near-caches. Messages are sent from a background thread and never
+    block the cache requests.
+    A subscription is a lease of lease seconds that the gateway renews by subscribing
+    again. Subscribers whose lease expired, or that failed max_failures pushes in a
+    row, are dropped so gateways that went away stop costing a timeout per push."""
+    def __init__(self, timeout=1.0, lease=30.0, max_failures=3):
+        self.timeout = timeout
+        self.lease = lease
+        self.max_failures = max_failures
+        # url -> [lease expiry (monotonic), consecutive failed pushes]
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.sender_thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.sender_thread.start()
+
+    def subscribe(self, url):
+        """Add or renew a subscription; returns the seconds it lasts"""
+        with self.lock:
+            failures = self.subscribers.get(url, [0, 0])[1]
+            self.subscribers[url] = [time.monotonic() + self.lease, failures]
+        return self.lease
+
+    def active_subscribers(self):
+        """URLs with a current lease, dropping the expired ones"""
+        now = time.monotonic()
+        with self.lock:
+            for url in [url for url, (expiry, _) in self.subscribers.items() if expiry < now]:
+                print(f"Invalidation subscription of {url} expired")
+                del self.subscribers[url]
+            return list(self.subscribers)
+
+    def publish(self, keys):
+        """Announce that keys changed; None means every key (after a flush)"""
+        if not self.active_subscribers():
+            return
+        self.queue.put(None if keys is None else list(keys))
+
+    def _record_push(self, url, ok):
+        with self.lock:
+            subscriber = self.subscribers.get(url)
+            if subscriber is None:
+                return
+            subscriber[1] = 0 if ok else subscriber[1] + 1
+            if subscriber[1] >= self.max_failures:
+                print(f"Dropping invalidation subscriber {url} after {subscriber[1]} failed pushes")
+                del self.subscribers[url]
+
+    def _send_loop(self):
+        while True:
+            # Merge the messages queued meanwhile into one request per subscriber
+            messages = [self.queue.get()]
+            while True:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if any(keys is None for keys in messages):
+                payload = {"all": True}
+            else:
+                payload = {"keys": [key for keys in messages for key in keys]}
+
+            for url in self.active_subscribers():
+                try:
+                    requests.post(url, json=payload, timeout=self.timeout).raise_for_status()
+                    self._record_push(url, True)
+                except requests.RequestException as e:
+                    print(f"Invalidation push to {url} failed: {e}")
+                    self._record_push(url, False)
@@ -0,0 +1,68 @@
+PREFIX_SEPARATORS = "_:/.-"
+
+
+def key_prefixes(key):
+    """Prefixes of key that end at a separator: complex_data_7 -> complex_, complex_data_"""
+    return [key[:i + 1] for i, char in enumerate(key) if char in PREFIX_SEPARATORS]
+
+
+class KeyIndex:
+    """Tags and prefixes of the keys cached in one lock stripe, so a group of keys can
+    be found in time proportional to the group. Not locked: it is only used under the
+    lock of its stripe."""
+    def __init__(self):
+        self.keys = {}  # key -> tuple of tags
+        self.tags = {}  # tag -> set of keys
+        self.prefixes = {}  # prefix -> set of keys
+
+    def add(self, key, tags=()):
+        """Index a cached key, replacing the tags it had"""
+        tags = tuple(tags or ())
+        old_tags = self.keys.get(key)
+        if old_tags is None:
+            for prefix in key_prefixes(key):
+                self.prefixes.setdefault(prefix, set()).add(key)
+        elif old_tags == tags:
+            return
+        else:
+            self._untag(key, old_tags)
+        self.keys[key] = tags
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+
+    def remove(self, key):
+        tags = self.keys.pop(key, None)
+        if tags is None:
+            return
+        self._untag(key, tags)
+        for prefix in key_prefixes(key):
+            self._discard(self.prefixes, prefix, key)
+
+    def tagged(self, tag):
+        return list(self.tags.get(tag, ()))
+
+    def with_prefix(self, prefix):
+        if prefix and prefix[-1] in PREFIX_SEPARATORS:
+            return list(self.prefixes.get(prefix, ()))
+        # Prefixes that do not end at a separator are not indexed and need a scan
+        return [key for key in self.keys if key.startswith(prefix)]
+
+    def tags_of(self, key):
+        return self.keys.get(key, ())
+
+    def clear(self):
+        self.keys.clear()
+        self.tags.clear()
+        self.prefixes.clear()
+
+    def _untag(self, key, tags):
+        for tag in tags:
+            self._discard(self.tags, tag, key)
+
+    @staticmethod
+    def _discard(groups, group, key):
+        keys = groups.get(group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del groups[group]
@@ -1,47 +1,348 @@
 from flask import Flask, request, jsonify
+import os
 import time
 import threading
+import heapq
+from collections import OrderedDict
+
+from cache_common import (ENTRY_OVERHEAD, TcpBackend, compacted_heap, enable_snapshots, expiry_heap,
+                          purge_due, run_service, start_expiry_thread)
+from cache_entry import CacheEntry
+from cache_size import estimate_size
+from invalidation import InvalidationPublisher
+from key_index import KeyIndex
+from cache_snapshot import restorable
 
 app = Flask(__name__)
 
-class CacheLevel:
-    def __init__(self, name, max_size, default_ttl=None):
-        self.name = name
-        self.max_size = max_size
-        self.default_ttl = default_ttl
-        self.cache = {}
-        self.stats = {
-            "hits": 0,
-            "misses": 0,
-            "sets": 0,
-            "evictions": 0,
-            "expirations": 0
-        }
+DEFAULT_STRIPES = 8
+
+# Entry size used to size the frequency sketch of a level from its byte budget
+TYPICAL_ENTRY_BYTES = 1024
+
+class ThreadLocalStats:
+    """Counters that each thread updates without locking, merged when read"""
+    def __init__(self, fields):
+        self.fields = fields
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.threads = []  # (thread, counters) for live threads
+        self.retired = dict.fromkeys(fields, 0)  # totals of finished threads
     
-    def get(self, key):
-        if key not in self.cache:
-            self.stats["misses"] += 1
-            return None
+    def _counters(self):
+        counters = getattr(self.local, "counters", None)
+        if counters is None:
+            counters = self.local.counters = dict.fromkeys(self.fields, 0)
+            with self.lock:
+                self._retire_finished()
+                self.threads.append((threading.current_thread(), counters))
+        return counters
+    
+    def _retire_finished(self):
+        """Fold the counters of finished threads, which can no longer change"""
+        alive = []
+        for thread, counters in self.threads:
+            if thread.is_alive():
+                alive.append((thread, counters))
+            else:
+                for field in self.fields:
+                    self.retired[field] += counters[field]
+        self.threads = alive
+    
+    def incr(self, field, amount=1):
+        self._counters()[field] += amount
+    
+    def snapshot(self):
+        with self.lock:
+            self._retire_finished()
+            totals = dict(self.retired)
+            for _, counters in self.threads:
+                for field in self.fields:
+                    totals[field] += counters[field]
+        return totals
+
+class CountMinSketch:
+    """Approximate access frequencies with 4-bit counters that are halved periodically,
+    so the estimates follow recent popularity (the TinyLFU frequency sketch).
+    Updates are not locked: a lost increment only makes an estimate slightly lower."""
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+    HALVE = bytes(count >> 1 for count in range(256))
+    
+    def __init__(self, capacity):
+        self.width = max(64, 4 * capacity)
+        self.rows = [bytearray(self.width) for _ in self.SEEDS]
+        self.sample_size = 10 * self.width
+        self.additions = 0
+    
+    def _indexes(self, key):
+        h = hash(key)
+        return [((h ^ seed) * 0x2545F4914F6CDD1D >> 17) % self.width for seed in self.SEEDS]
+    
+    def increment(self, key):
+        for row, index in zip(self.rows, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._age()
+    
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+    
+    def _age(self):
+        self.additions //= 2
+        for row in self.rows:
+            row[:] = row.translate(self.HALVE)
+
+class CacheStripe:
+    """Partition of a cache level holding the keys that hash to it, evicted in LRU order
+    until their estimated size fits in the stripe's byte budget"""
+    def __init__(self, max_bytes, lock):
+        self.max_bytes = max_bytes
+        self.lock = lock
+        self.bytes = 0
+        # Ordered from least to most recently used
+        self.cache = OrderedDict()
+        # Min-heap of (expiry, key); entries that were overwritten or evicted are skipped lazily
+        self.expiry_heap = []
+    
+    @property
+    def max_entry_bytes(self):
+        """Largest entry the stripe can hold"""
+        return self.max_bytes
+    
+    def record_miss(self, key):
+        pass
+    
+    def touch(self, key):
+        self.cache.move_to_end(key)
+    
+    def put(self, key, entry):
+        """Store an entry and return the keys evicted to make room for it.
+        An entry larger than max_entry_bytes is not stored and is returned as evicted."""
+        if key in self.cache:
+            self.remove(key)
+        if entry.size > self.max_entry_bytes:
+            return [key]
         
-        entry = self.cache[key]
-        current_time = time.time()
+        evicted = []
+        while self.bytes + entry.size > self.max_bytes:
+            victim, victim_entry = self.cache.popitem(last=False)
+            self.bytes -= victim_entry.size
+            evicted.append(victim)
+        self.cache[key] = entry
+        self.bytes += entry.size
+        return evicted
+    
+    def remove(self, key):
+        self.bytes -= self.cache.pop(key).size
+    
+    def ordered_entries(self):
+        """(key, entry) pairs from the first to the last entry to evict"""
+        return list(self.cache.items())
+    
+    def restore(self, items):
+        """Replace the content of the stripe with snapshot items, bypassing any admission policy"""
+        pairs, self.bytes = restorable(items, self.max_bytes)
+        self.cache = OrderedDict(pairs)
+
+class TinyLfuStripe(CacheStripe):
+    """W-TinyLFU: new keys enter a small LRU window; keys leaving the window are only
+    admitted to the segmented LRU main region if the frequency sketch says they are
+    accessed more often than the main region's eviction victims. A scan of cold keys
+    therefore churns the window instead of flushing the hot keys.
+    Segments are bounded by the estimated bytes of their entries."""
+    WINDOW_RATIO = 0.01
+    PROTECTED_RATIO = 0.8
+    
+    def __init__(self, max_bytes, lock, sketch):
+        super().__init__(max_bytes, lock)
+        self.cache = {}
+        self.sketch = sketch
+        # At least one typical entry: with a window smaller than an entry, every new key
+        # would go straight to the admission filter and lose against any known key
+        self.window_budget = min(max_bytes // 2, max(TYPICAL_ENTRY_BYTES, int(max_bytes * self.WINDOW_RATIO)))
+        self.main_budget = max_bytes - self.window_budget
+        self.protected_budget = int(self.main_budget * self.PROTECTED_RATIO)
+        self.window_bytes = 0
+        self.protected_bytes = 0
+        # Key order of each segment, from least to most recently used
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+    
+    @property
+    def max_entry_bytes(self):
+        # Every entry has to be admitted to the main region to stay
+        return self.main_budget
+    
+    def record_miss(self, key):
+        self.sketch.increment(key)
+    
+    def touch(self, key):
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.protected:
+            self.protected.move_to_end(key)
+        elif key in self.probation:
+            # A second hit in the main region promotes the key to the protected segment
+            del self.probation[key]
+            self.protected[key] = True
+            self.protected_bytes += self.cache[key].size
+            while self.protected_bytes > self.protected_budget:
+                demoted, _ = self.protected.popitem(last=False)
+                self.protected_bytes -= self.cache[demoted].size
+                self.probation[demoted] = True
+    
+    def put(self, key, entry):
+        if entry.size > self.max_entry_bytes:
+            if key in self.cache:
+                self.remove(key)
+            return [key]
         
-        # Check expiration
-        if entry["expiry"] and entry["expiry"] < current_time:
-            del self.cache[key]
-            self.stats["expirations"] += 1
-            return None
+        if key in self.cache:
+            # Overwrite in place, keeping the key in its segment
+            delta = entry.size - self.cache[key].size
+            self.cache[key] = entry
+            self.bytes += delta
+            if key in self.window:
+                self.window_bytes += delta
+            elif key in self.protected:
+                self.protected_bytes += delta
+            self.touch(key)
+        else:
+            self.sketch.increment(key)
+            self.cache[key] = entry
+            self.window[key] = True
+            self.window_bytes += entry.size
+            self.bytes += entry.size
+        return self._fit()
+    
+    def _fit(self):
+        """Move keys out of the window through the admission filter, then shrink the
+        main region if an overwrite made it grow past its budget"""
+        evicted = []
+        while self.window_bytes > self.window_budget:
+            candidate, _ = self.window.popitem(last=False)
+            self.window_bytes -= self.cache[candidate].size
+            evicted.extend(self._admit(candidate))
+        while self.bytes - self.window_bytes > self.main_budget:
+            victim = self._main_victim()
+            self.remove(victim)
+            evicted.append(victim)
+        return evicted
+    
+    def _admit(self, candidate):
+        """Move a key that left the window to the main region, evicting main entries that
+        are accessed less often than it. The candidate is dropped instead as soon as the
+        next victim is at least as popular."""
+        frequency = self.sketch.estimate(candidate)
+        evicted = []
+        # The candidate still counts in self.bytes, outside the window
+        while self.bytes - self.window_bytes > self.main_budget:
+            victim = self._main_victim()
+            if victim is None or self.sketch.estimate(victim) >= frequency:
+                self.remove(candidate)
+                evicted.append(candidate)
+                return evicted
+            self.remove(victim)
+            evicted.append(victim)
+        self.probation[candidate] = True
+        return evicted
+    
+    def ordered_entries(self):
+        return [(key, self.cache[key]) for segment in (self.probation, self.protected, self.window)
+                for key in segment]
+    
+    def restore(self, items):
+        # Restored keys were already admitted once; they go straight to the main region
+        pairs, self.bytes = restorable(items, self.main_budget)
+        self.cache = dict(pairs)
+        self.window = OrderedDict()
+        self.probation = OrderedDict((key, True) for key, _ in pairs)
+        self.protected = OrderedDict()
+        self.window_bytes = 0
+        self.protected_bytes = 0
+    
+    def _main_victim(self):
+        for segment in (self.probation, self.protected):
+            if segment:
+                return next(iter(segment))
+        return None
+    
+    def remove(self, key):
+        size = self.cache.pop(key).size
+        self.bytes -= size
+        if self.window.pop(key, None) is not None:
+            self.window_bytes -= size
+        elif self.protected.pop(key, None) is not None:
+            self.protected_bytes -= size
+        else:
+            self.probation.pop(key, None)
+
+class CacheLevel:
+    def __init__(self, name, max_bytes, default_ttl=None, locks=None, policy="lru", on_remove=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # Called with the keys evicted, expired or deleted, under the lock of their stripe
+        self.on_remove = on_remove
         
-        # Update access metadata
-        entry["last_accessed"] = current_time
-        entry["access_count"] += 1
+        # Keys are spread over stripes by hash, each with its own lock and share of max_bytes
+        if locks is None:
+            locks = [threading.RLock() for _ in range(DEFAULT_STRIPES)]
+        stripes = len(locks)
+        budgets = [max_bytes // stripes + (1 if i < max_bytes % stripes else 0) for i in range(stripes)]
         
-        self.stats["hits"] += 1
-        return entry["value"]
+        # "lru" evicts by recency only, "tinylfu" adds a frequency-based admission filter
+        if policy == "tinylfu":
+            self.sketch = CountMinSketch(max_bytes // TYPICAL_ENTRY_BYTES)
+            self.stripes = [TinyLfuStripe(budget, lock, self.sketch) for budget, lock in zip(budgets, locks)]
+        elif policy == "lru":
+            self.stripes = [CacheStripe(budget, lock) for budget, lock in zip(budgets, locks)]
+        else:
+            raise ValueError(f"{name}: unknown cache policy '{policy}'")
+        # A value has to fit in the stripe of its key, not just in the level
+        self.max_entry_bytes = min(stripe.max_entry_bytes for stripe in self.stripes)
+        self.stats = ThreadLocalStats(["hits", "misses", "sets", "evictions", "expirations"])
+    
+    def stripe_for(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+    
+    def __len__(self):
+        return sum(len(stripe.cache) for stripe in self.stripes)
+    
+    def bytes_used(self):
+        return sum(stripe.bytes for stripe in self.stripes)
+    
+    def get(self, key):
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            if key not in stripe.cache:
+                stripe.record_miss(key)
+                self.stats.incr("misses")
+                return None
+            
+            entry = stripe.cache[key]
+            current_time = time.time()
+            
+            # Check expiration
+            if entry.expiry and entry.expiry < current_time:
+                stripe.remove(key)
+                self.stats.incr("expirations")
+                self._removed([key])
+                return None
+            
+            # Update access metadata
+            entry.last_accessed = current_time
+            entry.access_count += 1
+            stripe.touch(key)
+            
+            self.stats.incr("hits")
+            return entry.value
     
     def set(self, key, value, ttl=None):
-        self.stats["sets"] += 1
-        
         # Apply default TTL if none specified
         if ttl is None:
             ttl = self.default_ttl
@@ -49,110 +350,255 @@ class CacheLevel:
         current_time = time.time()
         expiry = None if ttl is None else current_time + ttl
         
-        # Eviction if necessary
-        if key not in self.cache and len(self.cache) >= self.max_size:
-            self._evict()
-        
-        # Store the value
-        self.cache[key] = {
-            "value": value,
-            "created": current_time,
-            "last_accessed": current_time,
-            "access_count": 0,
-            "expiry": expiry
-        }
-    
-    def _evict(self):
-        """Evict based on LRU (Least Recently Used)"""
-        if not self.cache:
-            return
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            self.stats.incr("sets")
+            
+            # Store the value, evicting (or not admitting) entries as the policy decides
+            evicted = stripe.put(key, CacheEntry(value, current_time, expiry,
+                                                 estimate_size(key, value, ENTRY_OVERHEAD)))
+            if evicted:
+                self.stats.incr("evictions", len(evicted))
+                self._removed(evicted)
+            if key in stripe.cache and expiry is not None:
+                heapq.heappush(stripe.expiry_heap, (expiry, key))
+                stripe.expiry_heap = compacted_heap(stripe.expiry_heap, stripe.cache)
+    
+    def delete(self, key):
+        """Remove an entry, returning whether it was cached"""
+        stripe = self.stripe_for(key)
+        with stripe.lock:
+            if key not in stripe.cache:
+                return False
+            stripe.remove(key)
+            self._removed([key])
+            return True
+    
+    def snapshot(self):
+        """Entries as (key, value, created, expiry, size) tuples, from the first to the last to evict"""
+        entries = []
+        for stripe in self.stripes:
+            # Only references are copied under the lock; entries are replaced, not mutated,
+            # except for the access metadata, which is not saved
+            with stripe.lock:
+                stripe_entries = stripe.ordered_entries()
+            entries.extend((key, entry.value, entry.created, entry.expiry, entry.size)
+                           for key, entry in stripe_entries)
+        return entries
+    
+    def restore(self, entries):
+        """Replace the content of the level with the entries of a snapshot, skipping the
+        ones that expired meanwhile. Returns the number of entries loaded."""
+        by_stripe = [[] for _ in self.stripes]
+        for entry in entries:
+            by_stripe[hash(entry[0]) % len(self.stripes)].append(entry)
         
-        lru_key = min(self.cache.keys(), 
-                     key=lambda k: self.cache[k]["last_accessed"])
-        del self.cache[lru_key]
-        self.stats["evictions"] += 1
+        loaded = 0
+        for stripe, items in zip(self.stripes, by_stripe):
+            with stripe.lock:
+                stripe.restore(items)
+                stripe.expiry_heap = expiry_heap(stripe.cache)
+                loaded += len(stripe.cache)
+        return loaded
+    
+    def _removed(self, keys):
+        if self.on_remove is not None:
+            self.on_remove(keys)
+    
+    def purge_expired(self):
+        """Remove the entries whose expiry is due, touching only those entries.
+        Returns the next expiry time, or None when no entry expires."""
+        next_expiries = []
+        for stripe in self.stripes:
+            with stripe.lock:
+                next_expiries.append(purge_due(stripe.expiry_heap, stripe.cache,
+                                               lambda key: self._expire(stripe, key)))
+        return min((expiry for expiry in next_expiries if expiry is not None), default=None)
+    
+    def _expire(self, stripe, key):
+        stripe.remove(key)
+        self.stats.incr("expirations")
+        self._removed([key])
+    
 
 class MultiLevelCache:
-    def __init__(self):
-        # L1: Small, fast cache with short TTL
-        self.l1 = CacheLevel("L1", max_size=10, default_ttl=60)  # 1 minute TTL
+    def __init__(self, stripes=DEFAULT_STRIPES, policy="tinylfu",
+                 l1_bytes=256 * 1024, l2_bytes=2 * 1024 * 1024, l3_bytes=16 * 1024 * 1024):
+        # The levels share the stripe locks, so holding the lock of a key makes
+        # a lookup and its promotion between levels atomic for that key
+        self.locks = [threading.RLock() for _ in range(stripes)]
+        # Tags and prefixes of the keys cached in any level, one index per stripe lock
+        self.indexes = [KeyIndex() for _ in range(stripes)]
+        
+        # L1: Small, fast cache with short TTL (256 KiB by default)
+        self.l1 = CacheLevel("L1", max_bytes=l1_bytes, default_ttl=60, locks=self.locks, policy=policy,
+                             on_remove=self._forget)  # 1 minute TTL
         
-        # L2: Medium cache with longer TTL
-        self.l2 = CacheLevel("L2", max_size=50, default_ttl=300)  # 5 minutes TTL
+        # L2: Medium cache with longer TTL (2 MiB by default)
+        self.l2 = CacheLevel("L2", max_bytes=l2_bytes, default_ttl=300, locks=self.locks, policy=policy,
+                             on_remove=self._forget)  # 5 minutes TTL
         
-        # L3: Large, slower cache with long TTL
-        self.l3 = CacheLevel("L3", max_size=200, default_ttl=3600)  # 1 hour TTL
+        # L3: Large, slower cache with long TTL (16 MiB by default)
+        self.l3 = CacheLevel("L3", max_bytes=l3_bytes, default_ttl=3600, locks=self.locks, policy=policy,
+                             on_remove=self._forget)  # 1 hour TTL
         
-        # Start cleanup thread
-        self.cleanup_thread = threading.Thread(target=self._cleanup_expired, daemon=True)
-        self.cleanup_thread.start()
+        # Purges expired entries when the next one is due, at least every 30 seconds
+        self.cleanup_thread = start_expiry_thread(self.purge_expired, 30)
+    
+    def lock_for(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+    
+    def index_for(self, key):
+        return self.indexes[hash(key) % len(self.indexes)]
+    
+    def is_cached(self, key):
+        """Whether any level holds the key; call with the lock of the key held"""
+        i = hash(key) % len(self.locks)
+        return key in self.l1.stripes[i].cache or key in self.l2.stripes[i].cache or key in self.l3.stripes[i].cache
+    
+    def _forget(self, keys):
+        """Unindex the keys that a level dropped and no other level holds"""
+        for key in keys:
+            if not self.is_cached(key):
+                self.index_for(key).remove(key)
     
     def get(self, key):
-        # Try L1 first
-        value = self.l1.get(key)
-        if value is not None:
-            return {"value": value, "level": "L1", "hit": True}
-        
-        # Try L2
-        value = self.l2.get(key)
-        if value is not None:
-            # Promote to L1
-            self.l1.set(key, value)
-            return {"value": value, "level": "L2", "hit": True}
-        
-        # Try L3
-        value = self.l3.get(key)
-        if value is not None:
-            # Promote to L2
-            self.l2.set(key, value)
-            return {"value": value, "level": "L3", "hit": True}
-        
-        # Not in any cache
-        return {"value": None, "hit": False}
+        with self.lock_for(key):
+            # Try L1 first
+            value = self.l1.get(key)
+            if value is not None:
+                return {"value": value, "level": "L1", "hit": True}
+            
+            # Try L2
+            value = self.l2.get(key)
+            if value is not None:
+                # Promote to L1
+                self.l1.set(key, value)
+                return {"value": value, "level": "L2", "hit": True}
+            
+            # Try L3
+            value = self.l3.get(key)
+            if value is not None:
+                # Promote to L2
+                self.l2.set(key, value)
+                return {"value": value, "level": "L3", "hit": True}
+            
+            # Not in any cache
+            return {"value": None, "hit": False}
     
-    def set(self, key, value, ttl=None, level="all"):
-        if level == "all" or level == "L1":
-            self.l1.set(key, value, ttl)
-        
-        if level == "all" or level == "L2":
-            self.l2.set(key, value, ttl)
+    def set(self, key, value, ttl=None, level="all", tags=None):
+        """Store a value; tags replace the ones the key had"""
+        with self.lock_for(key):
+            if level == "all" or level == "L1":
+                self.l1.set(key, value, ttl)
+            
+            if level == "all" or level == "L2":
+                self.l2.set(key, value, ttl)
+            
+            if level == "all" or level == "L3":
+                self.l3.set(key, value, ttl)
+            
+            # Indexed after every level is set, since a level may not admit the key
+            if self.is_cached(key):
+                self.index_for(key).add(key, tags)
+            else:
+                self.index_for(key).remove(key)
+    
+    def delete(self, key):
+        """Remove a key from every level, returning whether any level had it"""
+        with self.lock_for(key):
+            deleted = [cache_level.delete(key) for cache_level in [self.l1, self.l2, self.l3]]
+            return any(deleted)
+    
+    def invalidate(self, tags=(), prefixes=()):
+        """Delete from every level the keys with any of the tags or prefixes, returning them.
+        Each stripe is visited once, and only the keys in the groups are touched."""
+        deleted = []
+        for lock, index in zip(self.locks, self.indexes):
+            with lock:
+                keys = set()
+                for tag in tags:
+                    keys.update(index.tagged(tag))
+                for prefix in prefixes:
+                    keys.update(index.with_prefix(prefix))
+                for key in keys:
+                    for cache_level in [self.l1, self.l2, self.l3]:
+                        cache_level.delete(key)
+                deleted.extend(keys)
+        return deleted
+    
+    def snapshot(self):
+        levels = {cache_level.name: cache_level.snapshot() for cache_level in [self.l1, self.l2, self.l3]}
+        tags = {}
+        for lock, index in zip(self.locks, self.indexes):
+            with lock:
+                tags.update((key, key_tags) for key, key_tags in index.keys.items() if key_tags)
+        levels["tags"] = tags
+        return levels
+    
+    def restore(self, levels):
+        """Load a snapshot taken with snapshot(), returning the entries loaded per level"""
+        loaded = {cache_level.name: cache_level.restore(levels.get(cache_level.name, []))
+                  for cache_level in [self.l1, self.l2, self.l3]}
         
-        if level == "all" or level == "L3":
-            self.l3.set(key, value, ttl)
+        # Rebuild the indexes from the keys that were loaded
+        tags = levels.get("tags", {})
+        for i, (lock, index) in enumerate(zip(self.locks, self.indexes)):
+            with lock:
+                index.clear()
+                for cache_level in [self.l1, self.l2, self.l3]:
+                    for key in cache_level.stripes[i].cache:
+                        index.add(key, tags.get(key))
+        return loaded
     
-    def _cleanup_expired(self):
-        """Periodically clean up expired entries"""
-        while True:
-            time.sleep(30)  # Run every 30 seconds
-            current_time = time.time()
-            
-            for cache_level in [self.l1, self.l2, self.l3]:
-                expired_keys = [
-                    k for k, v in cache_level.cache.items()
-                    if v["expiry"] and v["expiry"] < current_time
-                ]
-                
-                for key in expired_keys:
-                    del cache_level.cache[key]
-                    cache_level.stats["expirations"] += 1
+    def purge_expired(self):
+        """Purge every level, returning the next expiry time, or None"""
+        next_expiries = [cache_level.purge_expired() for cache_level in [self.l1, self.l2, self.l3]]
+        return min((expiry for expiry in next_expiries if expiry is not None), default=None)
     
     def get_stats(self):
-        return {
-            "L1": self.l1.stats,
-            "L2": self.l2.stats,
-            "L3": self.l3.stats,
-            "total_items": {
-                "L1": len(self.l1.cache),
-                "L2": len(self.l2.cache),
-                "L3": len(self.l3.cache)
-            }
-        }
+        levels = [self.l1, self.l2, self.l3]
+        stats = {cache_level.name: cache_level.stats.snapshot() for cache_level in levels}
+        stats["total_items"] = {cache_level.name: len(cache_level) for cache_level in levels}
+        stats["bytes_used"] = {cache_level.name: cache_level.bytes_used() for cache_level in levels}
+        stats["max_bytes"] = {cache_level.name: cache_level.max_bytes for cache_level in levels}
+        stats["max_entry_bytes"] = {cache_level.name: cache_level.max_entry_bytes for cache_level in levels}
+        return stats
 
 # Initialize the multi-level cache
-cache = MultiLevelCache()
+cache = MultiLevelCache(policy=os.environ.get("CACHE_POLICY", "tinylfu"))
+
+# Gateways subscribe to the keys written or deleted here to keep their near-caches consistent
+invalidations = InvalidationPublisher()
+
+# Warm start from the last snapshot, which is refreshed periodically and on exit.
+# Set CACHE_SNAPSHOT_FILE to an empty string to disable snapshots.
+snapshot_file = os.environ.get("CACHE_SNAPSHOT_FILE", "multi_level_cache.snapshot")
+snapshot_interval = float(os.environ.get("CACHE_SNAPSHOT_INTERVAL", 60))
+
+# Optionally record the keys looked up, one per line, to replay them with cache_admission_sim.py
+trace_file = open(os.environ["CACHE_TRACE_FILE"], "a", buffering=1) if os.environ.get("CACHE_TRACE_FILE") else None
+trace_lock = threading.Lock()
+
+def record_trace(keys):
+    if trace_file:
+        with trace_lock:
+            trace_file.writelines(key + "\n" for key in keys)
+
+def tcp_get(key):
+    record_trace([key])
+    result = cache.get(key)
+    return result["hit"], result.get("level"), result["value"]
+
+tcp_backend = TcpBackend(tcp_get, cache.set, cache.delete, invalidations)
+
+# Port of the binary protocol served next to the HTTP API, see cache_protocol.py.
+# Set CACHE_TCP_PORT to an empty string to disable it.
+tcp_port = os.environ.get("CACHE_TCP_PORT", "5014")
 
 @app.route("/cache/<key>", methods=["GET"])
 def get_cache(key):
+    record_trace([key])
     result = cache.get(key)
     return jsonify(result)
 
@@ -161,12 +607,62 @@ def set_cache(key):
     data = request.json
     ttl = data.get("ttl")
     level = data.get("level", "all")
-    cache.set(key, data.get("value"), ttl, level)
+    cache.set(key, data.get("value"), ttl, level, data.get("tags"))
+    invalidations.publish([key])
     return jsonify({"status": "ok"})
 
+@app.route("/cache/mget", methods=["POST"])
+def mget_cache():
+    keys = request.json.get("keys", [])
+    record_trace(keys)
+    return jsonify({"results": {key: cache.get(key) for key in keys}})
+
+@app.route("/cache/mset", methods=["POST"])
+def mset_cache():
+    items = request.json.get("items", [])
+    if not all("key" in item for item in items):
+        return jsonify({"error": "Every item needs a key"}), 400
+    for item in items:
+        cache.set(item["key"], item.get("value"), item.get("ttl"), item.get("level", "all"), item.get("tags"))
+    invalidations.publish(item["key"] for item in items)
+    return jsonify({"status": "ok", "count": len(items)})
+
+@app.route("/cache/mdel", methods=["POST"])
+def mdel_cache():
+    keys = request.json.get("keys", [])
+    deleted = sum(cache.delete(key) for key in keys)
+    invalidations.publish(keys)
+    return jsonify({"status": "ok", "deleted": deleted})
+
+@app.route("/cache/invalidate", methods=["POST"])
+def invalidate_cache():
+    """Delete every key with any of the given tags or key prefixes"""
+    data = request.json
+    tags = data.get("tags", [])
+    prefixes = data.get("prefixes", [])
+    if not tags and not prefixes:
+        return jsonify({"error": "tags or prefixes required"}), 400
+    keys = cache.invalidate(tags, prefixes)
+    if keys:
+        invalidations.publish(keys)
+    return jsonify({"status": "ok", "deleted": len(keys), "keys": keys})
+
+@app.route("/cache/subscribe", methods=["POST"])
+def subscribe():
+    """Register a URL that receives {"keys": [...]} whenever those keys change, for
+    the returned lease seconds unless it subscribes again"""
+    url = request.json.get("url")
+    if not url:
+        return jsonify({"error": "url required"}), 400
+    lease = invalidations.subscribe(url)
+    return jsonify({"status": "subscribed", "lease": lease})
+
 @app.route("/cache/stats", methods=["GET"])
 def get_stats():
     return jsonify(cache.get_stats())
 
 if __name__ == "__main__":
-    app.run(port=5004, debug=True)
+    snapshots = None
+    if snapshot_file:
+        snapshots = lambda: enable_snapshots(snapshot_file, snapshot_interval, cache.snapshot, cache.restore)
+    run_service(app, 5004, snapshots, tcp_backend, tcp_port)
@@ -0,0 +1,74 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class NearCache:
+    """Small in-process LRU cache with a short TTL, kept by the gateway in front of the
+    remote cache service. Entries are dropped when the cache service pushes an
+    invalidation for their key; the TTL bounds how stale an entry can get if an
+    invalidation message is lost."""
+    def __init__(self, max_entries=256, ttl=2.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (value, expiry), from least to most recently used
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped by every invalidation, see version()
+        self.invalidations = 0
+        # Only used while the gateway is subscribed to the cache service invalidations
+        self.enabled = False
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key):
+        """Return (found, value)"""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None or item[1] < time.time():
+                if item is not None:
+                    del self.entries[key]
+                self.stats["misses"] += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return True, item[0]
+
+    def version(self):
+        """Take before reading a key from the cache service, and pass it to put()"""
+        with self.lock:
+            return self.invalidations
+
+    def put(self, key, value, version):
+        """Store a value read from the cache service, unless an invalidation arrived
+        since version was taken: the value read may be older than that invalidation"""
+        with self.lock:
+            if not self.enabled or version != self.invalidations:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + self.ttl)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self.lock:
+            self.invalidations += 1
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.stats["invalidations"] += len(self.entries)
+            self.entries.clear()
+
+    def set_enabled(self, enabled):
+        with self.lock:
+            self.invalidations += 1
+            self.enabled = enabled
+            if not enabled:
+                self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "items": len(self.entries), "enabled": self.enabled}
@@ -0,0 +1,121 @@
+import bisect
+import threading
+import time
+from collections import deque
+
+# Upper bounds of the dispatch latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 60000]
+
+
+class LatencyHistogram:
+    """Counts of latencies per bucket, with the estimated percentiles taken from the
+    upper bound of the bucket they fall in. Not locked: the scheduler updates it
+    under its own lock."""
+    def __init__(self, bounds_ms=LATENCY_BUCKETS_MS):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1)  # the last bucket has no upper bound
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds_ms, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_ms
+
+    def snapshot(self):
+        # A list keeps the buckets in order in the JSON output; le_ms is None for the last one
+        buckets = [{"le_ms": bound, "count": count}
+                   for bound, count in zip(self.bounds_ms + [None], self.counts)]
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ms / self.count if self.count else 0,
+            "max_ms": self.max_ms,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "buckets": buckets
+        }
+
+
+class PriorityScheduler:
+    """Task queue with several priorities that workers block on. put() wakes exactly one
+    waiting worker, and get() hands out the task with the best priority, where waiting
+    makes a task climb one priority level every aging_interval seconds so lower
+    priorities are not starved. Tasks of the same priority come out in FIFO order."""
+    def __init__(self, priorities=("high", "normal", "low"), aging_interval=5.0):
+        self.priorities = list(priorities)
+        self.aging_interval = aging_interval
+        self.condition = threading.Condition()
+        # (enqueue time, task) per priority, oldest first
+        self.queues = {priority: deque() for priority in self.priorities}
+        self.latencies = {priority: LatencyHistogram() for priority in self.priorities}
+        self.aged = 0  # tasks dispatched ahead of a higher priority thanks to aging
+        self.closed = False
+
+    def put(self, priority, task):
+        with self.condition:
+            self.queues[priority].append((time.monotonic(), task))
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Wait for a task and return (priority, task, seconds it waited in the queue).
+        Returns None on timeout or once the scheduler is closed."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.closed or any(self.queues.values()), timeout):
+                return None
+            if self.closed:
+                return None
+
+            # Only the head of each queue can win: it is the one that waited the longest
+            now = time.monotonic()
+            best = None
+            for rank, priority in enumerate(self.priorities):
+                queue = self.queues[priority]
+                if queue:
+                    effective_rank = rank - (now - queue[0][0]) / self.aging_interval
+                    if best is None or effective_rank < best[0]:
+                        best = (effective_rank, rank, priority)
+            _, rank, priority = best
+            if any(self.queues[higher] for higher in self.priorities[:rank]):
+                self.aged += 1
+
+            enqueued, task = self.queues[priority].popleft()
+            waited = now - enqueued
+            self.latencies[priority].record(waited)
+            return priority, task, waited
+
+    def close(self):
+        """Wake every waiting worker; get() returns None from now on"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def qsize(self, priority):
+        with self.condition:
+            return len(self.queues[priority])
+
+    def sizes(self):
+        with self.condition:
+            return {priority: len(queue) for priority, queue in self.queues.items()}
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                "dispatch_latency": {priority: histogram.snapshot()
+                                     for priority, histogram in self.latencies.items()},
+                "aged_dispatches": self.aged,
+                "aging_interval": self.aging_interval
+            }
@@ -0,0 +1,46 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one loader per key at a time. Callers that ask for a key while its
+    loader is running wait for it and share its result (or its exception) instead of
+    calling the backends themselves."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, loader):
+        """Return (result, shared), where shared tells whether another caller ran the loader"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = loader()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+    def running(self, key):
+        with self.lock:
+            return key in self.calls
@@ -1,18 +1,18 @@
 from flask import Flask, request, jsonify
 import threading
 import time
-import queue
 import json
 from datetime import datetime
 
+from priority_scheduler import PriorityScheduler
+
 app = Flask(__name__)
 
-# Task queues with different priorities
-task_queues = {
-    "high": queue.PriorityQueue(),
-    "normal": queue.PriorityQueue(),
-    "low": queue.PriorityQueue()
-}
+# Seconds a waiting task needs to climb one priority level, so low tasks are not starved
+AGING_INTERVAL = 5.0
+
+# Task queues with different priorities; idle workers block on it until a task arrives
+scheduler = PriorityScheduler(["high", "normal", "low"], aging_interval=AGING_INTERVAL)
 
 # Track task statistics
 stats = {
@@ -32,14 +32,6 @@ NUM_WORKERS = 3
 worker_threads = []
 shutdown_flag = False
 
-def get_priority_value(priority_name):
-    """Convert priority name to numeric value (lower = higher priority)"""
-    if priority_name == "high":
-        return 0
-    elif priority_name == "low":
-        return 2
-    return 1  # Default "normal" priority
-
 def worker_thread(worker_id):
     """Worker thread function that processes tasks from queues"""
     print(f"Worker {worker_id} started")
@@ -48,27 +40,15 @@ def worker_thread(worker_id):
     tasks_processed = 0
     
     while not shutdown_flag:
-        task = None
-        queue_checked = None
-        
-        # Check high priority queue first, then normal, then low
-        for priority in ["high", "normal", "low"]:
-            if not task_queues[priority].empty():
-                try:
-                    # Get task but maintain priority inside the queue
-                    _, task = task_queues[priority].get(block=False)
-                    queue_checked = priority
-                    break
-                except queue.Empty:
-                    continue
-        
-        if task is None:
-            # No tasks in any queue, sleep briefly
-            time.sleep(0.1)
-            continue
+        # Block until a task arrives: high priority first, unless a lower one waited long enough
+        item = scheduler.get()
+        if item is None:
+            # The scheduler was closed
+            break
+        queue_checked, task, waited = item
         
         # Process the task
-        print(f"Worker {worker_id} processing task from {queue_checked} queue: {task}")
+        print(f"Worker {worker_id} processing task from {queue_checked} queue after waiting {waited:.3f}s: {task}")
         
         try:
             start_time = time.time()
@@ -121,19 +101,16 @@ def worker_thread(worker_id):
             with stats_lock:
                 stats["failed_tasks"] += 1
                 stats["queue_lengths"][queue_checked] -= 1
-        
-        finally:
-            # Mark task as done in the queue
-            task_queues[queue_checked].task_done()
 
 # Thread to monitor queues and stats
 def monitor_thread():
     """Periodically logs queue stats"""
     while not shutdown_flag:
         with stats_lock:
-            high_tasks = task_queues["high"].qsize()
-            normal_tasks = task_queues["normal"].qsize()
-            low_tasks = task_queues["low"].qsize()
+            sizes = scheduler.sizes()
+            high_tasks = sizes["high"]
+            normal_tasks = sizes["normal"]
+            low_tasks = sizes["low"]
             
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Queue status - " +
                   f"High: {high_tasks}, Normal: {normal_tasks}, Low: {low_tasks}")
@@ -157,21 +134,18 @@ def handle_task():
     # Add timestamp
     data["_timestamp"] = time.time()
     
-    # Calculate priority value (lower number = higher priority)
-    priority_value = get_priority_value(priority_name)
-    
-    # Add to appropriate queue with priority value
-    task_queues[priority_name].put((priority_value, data))
-    
-    # Update stats
+    # Update stats before a worker can take the task and decrement its queue length
     with stats_lock:
         stats["total_tasks"] += 1
         stats["queue_lengths"][priority_name] += 1
     
+    # Add to appropriate queue, waking one idle worker
+    scheduler.put(priority_name, data)
+    
     return jsonify({
         "status": "Task queued",
         "queue": priority_name,
-        "position": task_queues[priority_name].qsize()
+        "position": scheduler.qsize(priority_name)
     }), 202
 
 @app.route("/stats", methods=["GET"])
@@ -179,11 +153,9 @@ def get_stats():
     with stats_lock:
         current_stats = stats.copy()
         # Add current queue sizes
-        current_stats["current_queue_sizes"] = {
-            "high": task_queues["high"].qsize(),
-            "normal": task_queues["normal"].qsize(),
-            "low": task_queues["low"].qsize()
-        }
+        current_stats["current_queue_sizes"] = scheduler.sizes()
+    # Time from queuing to dispatch to a worker, per priority
+    current_stats.update(scheduler.get_stats())
     return jsonify(current_stats)
 
 def start_worker_threads():
@@ -0,0 +1,139 @@
+"""Benchmark of the worker task dispatch: the previous polling loop against PriorityScheduler.
+
+  - latency: tasks arrive at random intervals and are picked by --workers workers
+    that do no work; reports how long the tasks waited in the queue
+  - idle:    CPU time used by the idle workers over --idle seconds
+  - aging:   one worker is kept busy by a constant stream of high tasks while a
+    low task is queued; reports how long the low task waited
+
+Usage: python worker_dispatch_benchmark.py [--tasks 200] [--workers 3] [--idle 3]
+"""
+import argparse
+import queue
+import random
+import threading
+import time
+
+from priority_scheduler import PriorityScheduler
+
+
+class PollingQueues:
+    """The previous dispatch: one queue per priority, checked in order by every worker,
+    which sleeps 0.1 s when all of them are empty"""
+    def __init__(self, priorities=("high", "normal", "low")):
+        self.priorities = list(priorities)
+        self.queues = {priority: queue.Queue() for priority in self.priorities}
+        self.closed = False
+
+    def put(self, priority, task):
+        self.queues[priority].put((time.monotonic(), task))
+
+    def get(self):
+        while not self.closed:
+            for priority in self.priorities:
+                if not self.queues[priority].empty():
+                    try:
+                        enqueued, task = self.queues[priority].get(block=False)
+                        return priority, task, time.monotonic() - enqueued
+                    except queue.Empty:
+                        continue
+            time.sleep(0.1)
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def start_workers(scheduler, workers, work=0.0):
+    waits = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = scheduler.get()
+            if item is None:
+                return
+            priority, task, waited = item
+            with lock:
+                waits.append((priority, task, waited))
+            if work:
+                time.sleep(work)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads, waits
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure_latency(scheduler, tasks, workers):
+    threads, waits = start_workers(scheduler, workers)
+    rng = random.Random(1)
+    for i in range(tasks):
+        scheduler.put(rng.choice(["high", "normal", "low"]), {"id": i})
+        time.sleep(rng.expovariate(1 / 0.02))
+    while len(waits) < tasks:
+        time.sleep(0.01)
+    scheduler.close()
+    for thread in threads:
+        thread.join()
+    return [waited * 1000 for _, _, waited in waits]
+
+
+def measure_idle_cpu(scheduler, workers, seconds):
+    threads, _ = start_workers(scheduler, workers)
+    start = time.process_time()
+    time.sleep(seconds)
+    used = time.process_time() - start
+    scheduler.close()
+    for thread in threads:
+        thread.join()
+    return used
+
+
+def measure_aging(scheduler, work=0.01, timeout=10):
+    """Seconds a low task waits while a single worker always has high tasks queued"""
+    threads, waits = start_workers(scheduler, 1, work)
+    for i in range(10):
+        scheduler.put("high", {"id": i})
+    scheduler.put("low", {"id": "low"})
+    deadline = time.monotonic() + timeout
+    sent = 10
+    low_wait = None
+    while low_wait is None and time.monotonic() < deadline:
+        # Keep the high queue from ever draining
+        scheduler.put("high", {"id": sent})
+        sent += 1
+        time.sleep(work / 2)
+        low_wait = next((waited for _, task, waited in list(waits) if task["id"] == "low"), None)
+    scheduler.close()
+    for thread in threads:
+        thread.join()
+    return low_wait
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker dispatch latency: polling vs condition variable")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--idle", type=float, default=3.0, help="seconds of idle CPU measurement")
+    parser.add_argument("--aging-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{'dispatch':<10} {'p50 wait ms':>12} {'p99 wait ms':>12} {'idle CPU s':>11} {'low task wait s':>16}")
+    for name, make in [("polling", PollingQueues),
+                       ("scheduler", lambda: PriorityScheduler(aging_interval=args.aging_interval))]:
+        waits = measure_latency(make(), args.tasks, args.workers)
+        idle_cpu = measure_idle_cpu(make(), args.workers, args.idle)
+        low_wait = measure_aging(make())
+        low_wait = "starved" if low_wait is None else f"{low_wait:.2f}"
+        print(f"{name:<10} {percentile(waits, 0.5):>12.2f} {percentile(waits, 0.99):>12.2f} "
+              f"{idle_cpu:>11.3f} {low_wait:>16}")
+
+
+if __name__ == "__main__":
+    main()
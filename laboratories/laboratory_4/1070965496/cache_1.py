@@ -13,5 +13,29 @@ def set_cache(key):
     cache[key] = data.get("value")
     return jsonify({'status': 'ok'})
 
+@app.route("/cache/mget", methods=["POST"])
+def mget_cache():
+    keys = request.json.get("keys", [])
+    return jsonify({'results': {key: {'value': cache.get(key), 'hit': key in cache} for key in keys}})
+
+@app.route("/cache/mset", methods=["POST"])
+def mset_cache():
+    items = request.json.get("items", [])
+    if not all("key" in item for item in items):
+        return jsonify({'error': 'Every item needs a key'}), 400
+    for item in items:
+        cache[item["key"]] = item.get("value")
+    return jsonify({'status': 'ok', 'count': len(items)})
+
+@app.route("/cache/mdel", methods=["POST"])
+def mdel_cache():
+    keys = request.json.get("keys", [])
+    deleted = 0
+    for key in keys:
+        if key in cache:
+            cache.pop(key, None)
+            deleted += 1
+    return jsonify({'status': 'ok', 'deleted': deleted})
+
 if __name__ == "__main__":
     app.run(port=5004, debug=True)
\ No newline at end of file
@@ -3,15 +3,50 @@ import jwt, requests
 from functools import wraps
 from threading import Thread
 import time
-import random
+import os
+from hash_ring import HashRing
 
 app = Flask(__name__)
 SECRET_KEY = "secret"
 
 CACHES = ["http://127.0.0.1:5004", "http://127.0.0.1:5010"]
+# Every key is stored on CACHE_REPLICAS consecutive nodes of the ring. The default of 1
+# never stores a key on every node; a configured value is used as given
+CACHE_REPLICAS = int(os.environ.get("CACHE_REPLICAS", 1))
 
-def get_cache_instance():
-    return random.choice(CACHES)
+cache_ring = HashRing(CACHES, replicas=CACHE_REPLICAS)
+# The other gateways: every change of the cache nodes is applied to all of them
+# so they keep placing each key on the same caches
+PEER_GATEWAYS = [url for url in os.environ.get("PEER_GATEWAYS", "http://127.0.0.1:5000").split(",") if url]
+
+# Replicas per key with the current nodes
+def cache_replicas():
+    return min(CACHE_REPLICAS, len(cache_ring.nodes))
+
+def warn_full_replication():
+    # With a replica on every node each cache holds every key, so more caches add no capacity
+    if 1 < len(cache_ring.nodes) <= CACHE_REPLICAS:
+        app.logger.warning(f"CACHE_REPLICAS={CACHE_REPLICAS} stores every key on all {len(cache_ring.nodes)} cache nodes")
+
+def get_cache_instances(key):
+    # Same nodes for the same key on every gateway, primary first
+    return cache_ring.get_nodes(key, cache_replicas())
+
+def read_cache(key):
+    # Try the primary first and fall back to the replicas when it is down
+    for cache_url in get_cache_instances(key):
+        try:
+            return cache_url, requests.get(f"{cache_url}/cache/{key}", timeout=2).json()['value']
+        except requests.RequestException:
+            continue
+    return None, None
+
+def write_cache(key, value):
+    for cache_url in get_cache_instances(key):
+        try:
+            requests.post(f"{cache_url}/cache/{key}", json={'value': value}, timeout=2)
+        except requests.RequestException:
+            continue
 
 # Decorators (reuse token auth if desired)
 def token_required(f):
@@ -28,14 +63,62 @@ def token_required(f):
 @app.route("/data", methods=["GET"])
 @token_required
 def get_data():
-    cache_url = get_cache_instance()
-    cache_resp = requests.get(f"{cache_url}/cache/my_data").json()
-    if cache_resp['value']:
-        return jsonify({'cached': True, 'data': cache_resp['value'],"service_cache":cache_url,"gateway":"5011"})
+    cache_url, value = read_cache("my_data")
+    if value:
+        return jsonify({'cached': True, 'data': value,"service_cache":cache_url,"gateway":"5011"})
     db_resp = requests.get("http://127.0.0.1:5002/db").json()
-    requests.post(f"{cache_url}/cache/my_data", json={'value': db_resp['message']})
+    write_cache("my_data", db_resp['message'])
     return jsonify({'cached': False, 'data': db_resp['message'],"gateway":"5011"})
 
+# Cache nodes: adding or removing one only moves ~1/N of the keys
+@app.route("/cache-nodes", methods=["GET"])
+def list_cache_nodes():
+    return jsonify({'nodes': sorted(cache_ring.nodes), 'replicas': cache_replicas(),"gateway":"5011"})
+
+def propagate_cache_nodes(method):
+    # Forward the change to the peers, unless it was itself forwarded by one
+    if request.json.get("propagate") is False:
+        return {}
+    results = {}
+    for peer in PEER_GATEWAYS:
+        try:
+            response = requests.request(method, f"{peer}/cache-nodes", json={"url": request.json["url"], "propagate": False},
+                                        headers={"Authorization": request.headers.get("Authorization")}, timeout=2)
+            results[peer] = response.status_code
+        except requests.RequestException as e:
+            results[peer] = str(e)
+    return results
+
+def sync_cache_nodes():
+    # Take the nodes from the first peer that answers, in case they changed while this gateway was down
+    for peer in PEER_GATEWAYS:
+        try:
+            nodes = set(requests.get(f"{peer}/cache-nodes", timeout=2).json()["nodes"])
+        except (requests.RequestException, ValueError, KeyError):
+            continue
+        for node in nodes - cache_ring.nodes:
+            cache_ring.add_node(node)
+        for node in cache_ring.nodes - nodes:
+            cache_ring.remove_node(node)
+        break
+    warn_full_replication()
+
+@app.route("/cache-nodes", methods=["POST"])
+@token_required
+def add_cache_node():
+    cache_ring.add_node(request.json["url"])
+    warn_full_replication()
+    peers = propagate_cache_nodes("POST")
+    return jsonify({'nodes': sorted(cache_ring.nodes),"gateway":"5011", 'peers': peers})
+
+@app.route("/cache-nodes", methods=["DELETE"])
+@token_required
+def remove_cache_node():
+    cache_ring.remove_node(request.json["url"])
+    warn_full_replication()
+    peers = propagate_cache_nodes("DELETE")
+    return jsonify({'nodes': sorted(cache_ring.nodes),"gateway":"5011", 'peers': peers})
+
 # Trigger async task
 @app.route("/longtask", methods=["POST"])
 @token_required
@@ -45,4 +128,5 @@ def long_task():
     return jsonify({'status': 'Task queued',"gateway":"5011"}), 202
 
 if __name__ == "__main__":
+    sync_cache_nodes()
     app.run(port=5011, debug=True)
\ No newline at end of file
@@ -0,0 +1,70 @@
+import bisect
+import hashlib
+import threading
+
+
+def ring_hash(value):
+    # md5 spreads keys evenly and gives the same result in every process,
+    # unlike hash(), which changes with PYTHONHASHSEED
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing ring with virtual nodes.
+
+    Each node owns `vnodes` points of the ring, and a key belongs to the first
+    `replicas` distinct nodes found walking the ring clockwise from its hash.
+    Adding or removing a node only moves the keys of the arcs that node gains
+    or loses (~1/N of them)."""
+
+    def __init__(self, nodes=(), vnodes=100, replicas=1):
+        self.vnodes = vnodes
+        self.replicas = replicas
+        self.lock = threading.Lock()
+        self.nodes = set()
+        self.points = []  # sorted hashes
+        self.owners = {}  # hash -> node
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        with self.lock:
+            if node in self.nodes:
+                return
+            self.nodes.add(node)
+            for i in range(self.vnodes):
+                point = ring_hash(f"{node}#{i}")
+                # An md5 collision between nodes is unlikely; if it happens the first owner stays
+                if point in self.owners:
+                    continue
+                self.owners[point] = node
+                bisect.insort(self.points, point)
+
+    def remove_node(self, node):
+        with self.lock:
+            if node not in self.nodes:
+                return
+            self.nodes.discard(node)
+            self.points = [p for p in self.points if self.owners[p] != node]
+            self.owners = {p: self.owners[p] for p in self.points}
+
+    def get_nodes(self, key, replicas=None):
+        """Nodes responsible for the key, primary first"""
+        with self.lock:
+            count = min(replicas or self.replicas, len(self.nodes))
+            points, owners = self.points, self.owners
+            found = []
+            if not points:
+                return found
+            start = bisect.bisect(points, ring_hash(key))
+            for i in range(len(points)):
+                node = owners[points[(start + i) % len(points)]]
+                if node not in found:
+                    found.append(node)
+                    if len(found) == count:
+                        break
+            return found
+
+    def get_node(self, key):
+        nodes = self.get_nodes(key, 1)
+        return nodes[0] if nodes else None
@@ -1,15 +1,47 @@
 from flask import Flask, request, jsonify
 import jwt, requests
 from functools import wraps
-import random
+import os
+from hash_ring import HashRing
 
 app = Flask(__name__)
 SECRET_KEY = "secret"
 
 CACHES = ["http://127.0.0.1:5004", "http://127.0.0.1:5007"]
+# Cada clave se guarda en CACHE_REPLICAS nodos consecutivos del anillo. El valor por
+# defecto (1) nunca la guarda en todos los nodos; un valor configurado se usa tal cual
+CACHE_REPLICAS = int(os.environ.get("CACHE_REPLICAS", 1))
 
-def get_cache_instance():
-    return random.choice(CACHES)
+cache_ring = HashRing(CACHES, replicas=CACHE_REPLICAS)
+
+# Réplicas por clave con los nodos actuales
+def cache_replicas():
+    return min(CACHE_REPLICAS, len(cache_ring.nodes))
+
+def warn_full_replication():
+    # Con una réplica en cada nodo todas las cachés guardan todas las claves y añadir cachés no añade capacidad
+    if 1 < len(cache_ring.nodes) <= CACHE_REPLICAS:
+        app.logger.warning(f"CACHE_REPLICAS={CACHE_REPLICAS} guarda cada clave en los {len(cache_ring.nodes)} nodos de cache")
+
+def get_cache_instances(key):
+    """Nodos de cache de la clave, el primario primero, siempre los mismos para la misma clave"""
+    return cache_ring.get_nodes(key, cache_replicas())
+
+def read_cache(key):
+    # Se prueba el primario y, si no responde, las réplicas en orden
+    for cache_url in get_cache_instances(key):
+        try:
+            return cache_url, requests.get(f"{cache_url}/cache/{key}", timeout=2).json()['value']
+        except requests.RequestException:
+            continue
+    return None, None
+
+def write_cache(key, value):
+    for cache_url in get_cache_instances(key):
+        try:
+            requests.post(f"{cache_url}/cache/{key}", json={'value': value}, timeout=2)
+        except requests.RequestException:
+            continue
 
 def token_required(f):
     @wraps(f)
@@ -41,14 +73,32 @@ def metrics():
 @app.route("/data", methods=["GET"])
 @token_required
 def get_data():
-    cache_url = get_cache_instance()
-    cache_resp = requests.get(f"{cache_url}/cache/my_data").json()
-    if cache_resp['value']:
-        return jsonify({'cached': True, 'data': cache_resp['value']})
+    cache_url, value = read_cache("my_data")
+    if value:
+        return jsonify({'cached': True, 'data': value, 'cache': cache_url})
     db_resp = requests.get("http://127.0.0.1:5002/db").json()
-    requests.post(f"{cache_url}/cache/my_data", json={'value': db_resp['message']})
+    write_cache("my_data", db_resp['message'])
     return jsonify({'cached': False, 'data': db_resp['message']})
 
+# Nodos de cache: al agregar o quitar uno solo se mueven ~1/N de las claves
+@app.route("/cache-nodes", methods=["GET"])
+def list_cache_nodes():
+    return jsonify({'nodes': sorted(cache_ring.nodes), 'replicas': cache_replicas()})
+
+@app.route("/cache-nodes", methods=["POST"])
+@token_required
+def add_cache_node():
+    cache_ring.add_node(request.json["url"])
+    warn_full_replication()
+    return jsonify({'nodes': sorted(cache_ring.nodes)})
+
+@app.route("/cache-nodes", methods=["DELETE"])
+@token_required
+def remove_cache_node():
+    cache_ring.remove_node(request.json["url"])
+    warn_full_replication()
+    return jsonify({'nodes': sorted(cache_ring.nodes)})
+
 @app.route("/longtask", methods=["POST"])
 @token_required
 def long_task():
@@ -57,4 +107,5 @@ def long_task():
     return jsonify({'status': 'Task queued'}), 202
 
 if __name__ == "__main__":
+    warn_full_replication()
     app.run(port=5000, debug=True)
\ No newline at end of file
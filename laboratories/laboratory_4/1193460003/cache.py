@@ -21,6 +21,42 @@ def set_cache(key):
     cache[key] = (data.get("value"), expiry)
     return jsonify({'status': 'ok', 'expires_at': expiry})
 
+@app.route("/cache/mget", methods=["POST"])
+def mget_cache():
+    keys = request.json.get("keys", [])
+    now = time.time()
+    results = {}
+    for key in keys:
+        entry = cache.get(key)
+        if not entry or entry[1] < now:
+            cache.pop(key, None)
+            results[key] = {'value': None, 'hit': False}
+        else:
+            results[key] = {'value': entry[0], 'hit': True}
+    return jsonify({'results': results})
+
+@app.route("/cache/mset", methods=["POST"])
+def mset_cache():
+    items = request.json.get("items", [])
+    if not all("key" in item for item in items):
+        return jsonify({'error': 'Every item needs a key'}), 400
+    now = time.time()
+    for item in items:
+        # Un ttl nulo usa el TTL por defecto
+        ttl = item.get("ttl")
+        cache[item["key"]] = (item.get("value"), now + (TTL if ttl is None else ttl))
+    return jsonify({'status': 'ok', 'count': len(items)})
+
+@app.route("/cache/mdel", methods=["POST"])
+def mdel_cache():
+    keys = request.json.get("keys", [])
+    deleted = 0
+    for key in keys:
+        if key in cache:
+            cache.pop(key, None)
+            deleted += 1
+    return jsonify({'status': 'ok', 'deleted': deleted})
+
 # Hilo para limpiar expirados
 def cleanup_loop():
     while True:
@@ -0,0 +1,70 @@
+import bisect
+import hashlib
+import threading
+
+
+def ring_hash(value):
+    # md5 reparte bien las claves y da el mismo resultado en todos los procesos,
+    # a diferencia de hash() que cambia con PYTHONHASHSEED
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales.
+
+    Cada nodo ocupa `vnodes` puntos del anillo y una clave pertenece a los
+    `replicas` primeros nodos distintos que se encuentran al recorrer el anillo
+    desde su hash. Al agregar o quitar un nodo solo cambian de dueño las claves
+    de los arcos que ese nodo gana o pierde (~1/N del total)."""
+
+    def __init__(self, nodes=(), vnodes=100, replicas=1):
+        self.vnodes = vnodes
+        self.replicas = replicas
+        self.lock = threading.Lock()
+        self.nodes = set()
+        self.points = []  # hashes ordenados
+        self.owners = {}  # hash -> nodo
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        with self.lock:
+            if node in self.nodes:
+                return
+            self.nodes.add(node)
+            for i in range(self.vnodes):
+                point = ring_hash(f"{node}#{i}")
+                # Una colisión de md5 entre nodos es improbable; si ocurre se conserva el primero
+                if point in self.owners:
+                    continue
+                self.owners[point] = node
+                bisect.insort(self.points, point)
+
+    def remove_node(self, node):
+        with self.lock:
+            if node not in self.nodes:
+                return
+            self.nodes.discard(node)
+            self.points = [p for p in self.points if self.owners[p] != node]
+            self.owners = {p: self.owners[p] for p in self.points}
+
+    def get_nodes(self, key, replicas=None):
+        """Nodos responsables de la clave, el primario primero"""
+        with self.lock:
+            count = min(replicas or self.replicas, len(self.nodes))
+            points, owners = self.points, self.owners
+            found = []
+            if not points:
+                return found
+            start = bisect.bisect(points, ring_hash(key))
+            for i in range(len(points)):
+                node = owners[points[(start + i) % len(points)]]
+                if node not in found:
+                    found.append(node)
+                    if len(found) == count:
+                        break
+            return found
+
+    def get_node(self, key):
+        nodes = self.get_nodes(key, 1)
+        return nodes[0] if nodes else None
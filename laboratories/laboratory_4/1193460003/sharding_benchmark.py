@@ -0,0 +1,149 @@
+"""Benchmark de reparto de claves entre varios nodos de cache.
+
+Simula N nodos de cache LRU de capacidad fija en memoria (sin servidores) y
+compara cómo eligen nodo:
+  - random: random.choice(CACHES), lo que hacía el gateway
+  - modulo: hash(clave) % N
+  - ring:   HashRing con nodos virtuales, con R réplicas
+
+Las peticiones siguen una distribución Zipf. Se agregan nodos de uno en uno
+(scale-out: los nodos viejos conservan su contenido y el nuevo empieza vacío) y
+en cada paso se miden la fracción de claves que cambian de nodo primario, el hit
+ratio de las primeras --window peticiones después del cambio y el de la fase
+completa.
+
+Uso: python sharding_benchmark.py [--keys 20000] [--requests 200000] [--capacity 2000]
+"""
+import argparse
+import bisect
+import itertools
+import random
+from collections import OrderedDict
+
+from hash_ring import HashRing, ring_hash
+
+
+class LruNode:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+
+    def get(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return True
+        return False
+
+    def set(self, key):
+        self.items[key] = True
+        self.items.move_to_end(key)
+        if len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+
+class RandomPlacement:
+    name = "random"
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+
+    def add_node(self, node):
+        self.nodes.append(node)
+
+    def get_nodes(self, key):
+        return [random.choice(self.nodes)]
+
+
+class ModuloPlacement(RandomPlacement):
+    name = "modulo"
+
+    def get_nodes(self, key):
+        return [self.nodes[ring_hash(key) % len(self.nodes)]]
+
+
+class RingPlacement:
+    def __init__(self, nodes, replicas):
+        self.name = f"ring R={replicas}"
+        self.ring = HashRing(nodes, replicas=replicas)
+
+    def add_node(self, node):
+        self.ring.add_node(node)
+
+    def get_nodes(self, key):
+        return self.ring.get_nodes(key)
+
+
+def zipf_stream(keys, count, s, seed):
+    # Pesos acumulados de Zipf para muestrear con bisect
+    weights = list(itertools.accumulate(1 / (rank ** s) for rank in range(1, keys + 1)))
+    rng = random.Random(seed)
+    total = weights[-1]
+    for _ in range(count):
+        yield f"key:{bisect.bisect(weights, rng.random() * total)}"
+
+
+def run_phase(placement, nodes, stream):
+    """Lee cada clave como el gateway: primario primero, luego réplicas; si falla en
+    todos la trae de la base de datos y la escribe en todos sus nodos"""
+    hits = requests = 0
+    for key in stream:
+        requests += 1
+        targets = placement.get_nodes(key)
+        if any(nodes[node].get(key) for node in targets):
+            hits += 1
+            continue
+        for node in targets:
+            nodes[node].set(key)
+    return hits / requests
+
+
+def moved_fraction(before, after):
+    return sum(1 for key in before if before[key] != after[key]) / len(before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit ratio y movimiento de claves al agregar nodos de cache")
+    parser.add_argument("--keys", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200000, help="peticiones por fase")
+    parser.add_argument("--capacity", type=int, default=2000, help="entradas por nodo")
+    parser.add_argument("--start-nodes", type=int, default=2)
+    parser.add_argument("--end-nodes", type=int, default=5)
+    parser.add_argument("--zipf", type=float, default=0.9)
+    parser.add_argument("--window", type=int, default=10000, help="peticiones medidas justo después de agregar un nodo")
+    args = parser.parse_args()
+
+    names = [f"http://127.0.0.1:{5004 + i}" for i in range(args.end_nodes)]
+    sample = [f"key:{i}" for i in range(args.keys)]
+    strategies = [
+        lambda nodes: RandomPlacement(nodes),
+        lambda nodes: ModuloPlacement(nodes),
+        lambda nodes: RingPlacement(nodes, 1),
+        lambda nodes: RingPlacement(nodes, 2),
+    ]
+
+    print(f"{'strategy':<10} {'nodes':>5} {'keys moved':>11} {'hit ratio (window)':>19} {'hit ratio':>10}")
+    for make in strategies:
+        random.seed(1)
+        placement = make(names[:args.start_nodes])
+        nodes = {name: LruNode(args.capacity) for name in names}
+        # Fase de calentamiento para que los nodos iniciales estén llenos
+        run_phase(placement, nodes, zipf_stream(args.keys, args.requests, args.zipf, 0))
+        for count in range(args.start_nodes, args.end_nodes + 1):
+            if count > args.start_nodes:
+                before = {key: placement.get_nodes(key)[0] for key in sample}
+                placement.add_node(names[count - 1])
+                after = {key: placement.get_nodes(key)[0] for key in sample}
+                # Con random la clave no tiene nodo fijo: cualquier lectura puede caer en otro
+                moved = "-" if placement.name == "random" else f"{moved_fraction(before, after):.1%}"
+            else:
+                moved = ""
+            stream = zipf_stream(args.keys, args.requests, args.zipf, count)
+            window_hit_ratio = run_phase(placement, nodes, itertools.islice(stream, args.window))
+            rest_hit_ratio = run_phase(placement, nodes, stream)
+            hit_ratio = (window_hit_ratio * args.window + rest_hit_ratio * (args.requests - args.window)) / args.requests
+            print(f"{placement.name:<10} {count:>5} {moved:>11} {window_hit_ratio:>19.1%} {hit_ratio:>10.1%}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Measures the latency overhead added by the generated API gateway.
+
+A local stub backend is started together with two gateways that proxy to it:
+
+- before: the original proxy, which opens a new httpx.AsyncClient per request.
+- after:  the gateway emitted by generate_api_gateway, with one shared
+          keep-alive client per upstream.
+
+Overhead is reported as the p50/p99 latency through each gateway minus the
+latency of calling the stub backend directly.
+
+Usage:
+    python benchmark_gateway.py --requests 2000 --concurrency 8
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, HTTPException
+
+from transformations import generate_api_gateway
+
+STUB_PORT = 8101
+BEFORE_PORT = 8102
+AFTER_PORT = 8103
+STUB_URL = f'http://127.0.0.1:{STUB_PORT}'
+
+
+def create_stub_backend():
+    stub = FastAPI()
+
+    @stub.get('/systems')
+    async def systems():
+        return {'systems': [[1, 'alpha'], [2, 'beta']]}
+
+    @stub.get('/health')
+    async def health():
+        return {'status': 'ok'}
+
+    @stub.post('/create')
+    async def create(request: Request):
+        await request.body()
+        return {'status': 'created'}
+
+    return stub
+
+
+# The proxy as it was generated before the shared client was introduced
+def create_before_gateway():
+    gateway = FastAPI()
+
+    @gateway.get('/systems')
+    async def systems(request: Request):
+        headers = dict(request.headers)
+        if 'host' in headers:
+            del headers['host']
+        async with httpx.AsyncClient() as client:
+            try:
+                response = await client.get(f'{STUB_URL}/systems', params=dict(request.query_params), headers=headers)
+                return response.json()
+            except httpx.RequestError as e:
+                raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+
+    return gateway
+
+
+def create_after_gateway(workdir):
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        generate_api_gateway('bench_gateway', {'stub': 'backend'})
+    finally:
+        os.chdir(cwd)
+
+    spec = importlib.util.spec_from_file_location(
+        'bench_gateway_app', os.path.join(workdir, 'skeleton', 'bench_gateway', 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # The gateway would reach the stub backend at http://stub:80; point it at the local stub
+    module.SERVICE_ROUTES['stub'] = STUB_URL
+    return module.app
+
+
+def serve(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def measure(url, total, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(count):
+        with httpx.Client() as client:
+            client.get(url)  # warm up the keep-alive connection
+            for _ in range(count):
+                start = time.perf_counter()
+                client.get(url).raise_for_status()
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+
+    per_worker = total // concurrency
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, [per_worker] * concurrency))
+    return latencies
+
+
+def percentile(values, pct):
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the generated API gateway overhead')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        servers = [
+            serve(create_stub_backend(), STUB_PORT),
+            serve(create_before_gateway(), BEFORE_PORT),
+            serve(create_after_gateway(workdir), AFTER_PORT),
+        ]
+
+        direct = measure(f'{STUB_URL}/systems', args.requests, args.concurrency)
+        direct_p50, direct_p99 = percentile(direct, 50), percentile(direct, 99)
+        print(f"{'target':<10}{'p50 ms':>10}{'p99 ms':>10}{'p50 overhead':>15}{'p99 overhead':>15}")
+        print(f"{'direct':<10}{direct_p50:>10.2f}{direct_p99:>10.2f}{'-':>15}{'-':>15}")
+
+        for label, port in [('before', BEFORE_PORT), ('after', AFTER_PORT)]:
+            latencies = measure(f'http://127.0.0.1:{port}/systems', args.requests, args.concurrency)
+            p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+            print(f"{label:<10}{p50:>10.2f}{p99:>10.2f}{p50 - direct_p50:>15.2f}{p99 - direct_p99:>15.2f}")
+
+        for server in servers:
+            server.should_exit = True
+
+
+if __name__ == '__main__':
+    main()
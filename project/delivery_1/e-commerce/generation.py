@@ -1,8 +1,17 @@
-from metamodel import create_metamodel
-from transformations import apply_transformations
+import argparse
+
+from metamodel import load_model
+from transformations import apply_transformations, GenerationError, ModelValidationError
 
 if __name__ == '__main__':
-    
-    metamodel = create_metamodel()
-    model = metamodel.model_from_file('model.arch')
-    apply_transformations(model)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description='Generate the system skeleton from an architecture model')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of components rendered and written in parallel (default: 1)')
+    args = parser.parse_args()
+
+    model = load_model('model.arch')
+    try:
+        apply_transformations(model, workers=args.workers)
+    except (GenerationError, ModelValidationError) as e:
+        raise SystemExit(str(e))
\ No newline at end of file
@@ -0,0 +1,93 @@
+from collections import defaultdict, deque
+
+# Indexed view of an architecture model, built once from model.elements.
+# Connectors are stored as adjacency lists per connector type in both
+# directions, so every lookup is a dict access instead of a scan.
+class ArchitectureGraph:
+    def __init__(self, model):
+        self.components = {}
+        self.settings = {}
+        self.by_type = defaultdict(list)
+        self.edges = defaultdict(lambda: defaultdict(list))
+        self.reverse_edges = defaultdict(lambda: defaultdict(list))
+
+        for e in model.elements:
+            if e.__class__.__name__ == 'Component':
+                self.components[e.name] = e.type
+                self.settings[e.name] = {s.key: s.value for s in e.settings}
+                self.by_type[e.type].append(e.name)
+
+        for e in model.elements:
+            if e.__class__.__name__ == 'Connector':
+                source, target = getattr(e, 'from').name, e.to.name
+                self.edges[e.type][source].append(target)
+                self.reverse_edges[e.type][target].append(source)
+
+        self.order = self._dependency_order()
+
+    def of_type(self, ctype):
+        return self.by_type.get(ctype, [])
+
+    # Components reached from name through connectors of the given type
+    def targets(self, name, connector, ctype=None):
+        targets = self.edges[connector].get(name, [])
+        return [t for t in targets if ctype is None or self.components[t] == ctype]
+
+    # Components that reach name through connectors of the given type
+    def sources(self, name, connector, ctype=None):
+        sources = self.reverse_edges[connector].get(name, [])
+        return [s for s in sources if ctype is None or self.components[s] == ctype]
+
+    def target(self, name, connector, ctype=None):
+        targets = self.targets(name, connector, ctype)
+        return targets[0] if targets else None
+
+    # Components reached from name through any chain of connectors of the given
+    # type, in declaration order
+    def reachable(self, name, connector, ctype=None):
+        return self._walk(self.edges[connector], name, ctype)
+
+    # Components that reach name through any chain of connectors of the given
+    # type, in declaration order
+    def reaching(self, name, connector, ctype=None):
+        return self._walk(self.reverse_edges[connector], name, ctype)
+
+    def _walk(self, adjacency, name, ctype):
+        seen = {name}
+        queue = deque([name])
+        while queue:
+            for neighbour in adjacency.get(queue.popleft(), []):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+        return [c for c in self.components
+                if c in seen and c != name and (ctype is None or self.components[c] == ctype)]
+
+    # Topological order in which every component comes after the components it
+    # connects to. Ties keep declaration order; components on a cycle are
+    # appended in declaration order as well.
+    def _dependency_order(self):
+        pending = {name: 0 for name in self.components}
+        dependants = defaultdict(list)
+        for adjacency in self.edges.values():
+            for source, targets in adjacency.items():
+                for target in targets:
+                    pending[source] += 1
+                    dependants[target].append(source)
+
+        position = {name: i for i, name in enumerate(self.components)}
+        ready = deque(name for name in self.components if pending[name] == 0)
+        order = []
+        while ready:
+            name = ready.popleft()
+            order.append(name)
+            released = []
+            for dependant in dependants[name]:
+                pending[dependant] -= 1
+                if pending[dependant] == 0:
+                    released.append(dependant)
+            ready.extend(sorted(released, key=position.get))
+
+        placed = set(order)
+        order.extend(name for name in self.components if name not in placed)
+        return order
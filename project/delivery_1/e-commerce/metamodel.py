@@ -1,7 +1,88 @@
 import os
+import json
+import hashlib
+import functools
 
 from textx import metamodel_from_file
 
+GRAMMAR = os.path.join(os.path.dirname(__file__), 'arch.tx')
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '.arch_cache')
+
+# Plain data versions of the grammar rules, used for models loaded from the cache.
+# They expose the same attributes as the textX objects the transformations read.
+class Model:
+    def __init__(self, elements):
+        self.elements = elements
+
+class Component:
+    def __init__(self, type, name, settings):
+        self.type = type
+        self.name = name
+        self.settings = settings
+
+class Setting:
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+class Connector:
+    def __init__(self, type, source, target):
+        self.type = type
+        setattr(self, 'from', source)
+        self.to = target
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def _metamodel(grammar_hash):
+    return metamodel_from_file(GRAMMAR)
+
 def create_metamodel():
-    grammar = os.path.join(os.path.dirname(__file__), 'arch.tx')
-    return metamodel_from_file(grammar)
\ No newline at end of file
+    return _metamodel(file_hash(GRAMMAR))
+
+def model_to_data(model):
+    elements = []
+    for e in model.elements:
+        if e.__class__.__name__ == 'Component':
+            elements.append({'component': e.type, 'name': e.name,
+                             'settings': [[s.key, s.value] for s in e.settings]})
+        else:
+            elements.append({'connector': e.type, 'from': getattr(e, 'from').name, 'to': e.to.name})
+    return elements
+
+def model_from_data(elements):
+    components = {e['name']: Component(e['component'], e['name'], [Setting(k, v) for k, v in e['settings']])
+                  for e in elements if 'component' in e}
+    return Model([
+        components[e['name']] if 'component' in e
+        else Connector(e['connector'], components[e['from']], components[e['to']])
+        for e in elements
+    ])
+
+# Parsed models keyed by grammar and model hash, kept in memory and on disk
+_models = {}
+
+def load_model(path):
+    with open(path, 'rb') as f:
+        source = f.read()
+    key = hashlib.sha256(file_hash(GRAMMAR).encode() + source).hexdigest()
+    if key in _models:
+        return _models[key]
+
+    cache_file = os.path.join(CACHE_DIR, f'{key}.json')
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            data = json.load(f)
+    else:
+        data = model_to_data(create_metamodel().model_from_file(path))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first so a concurrent run never reads a partial cache entry
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, cache_file)
+
+    model = _models[key] = model_from_data(data)
+    return model
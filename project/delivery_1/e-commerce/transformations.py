@@ -1,11 +1,125 @@
-import os, textwrap
-
-def generate_database(name):
-
-    path = f'skeleton/{name}'
+import os, io, json, hashlib, threading, textwrap
+from concurrent.futures import ThreadPoolExecutor
+
+from graph import ArchitectureGraph
+
+LB_STRATEGIES = ('round_robin', 'weighted', 'least_outstanding', 'power_of_two', 'ewma')
+PROXY_MODES = ('json', 'stream')
+
+SKELETON_DIR = 'skeleton'
+MANIFEST_FILE = '.manifest.json'
+
+# Any change to the templates in this file invalidates every component
+with open(__file__, 'rb') as _source:
+    GENERATOR_HASH = hashlib.sha256(_source.read()).hexdigest()
+
+# Manifest of the current apply_transformations run, None when generators are called directly
+_manifest = None
+
+# Raised after a run in which one or more components failed to generate
+class GenerationError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        details = '\n'.join(f"  {name}: {error!r}" for name, error in sorted(errors.items()))
+        super().__init__(f"{len(errors)} component(s) failed to generate:\n{details}")
+
+# The model describes a system that cannot be generated; nothing is written
+class ModelValidationError(Exception):
+    def __init__(self, problems):
+        self.problems = problems
+        details = '\n'.join(f"  {name}: {problem}" for name, problem in sorted(problems.items()))
+        super().__init__(f"Invalid architecture model:\n{details}")
+
+def content_hash(data):
+    return hashlib.sha256(data.encode()).hexdigest()
+
+# Content hash of a file on disk, None when it does not exist
+def file_hash(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return content_hash(f.read())
+
+# Content hashes of the generated files and of the inputs of each component.
+# Files are grouped by component using the first directory under skeleton/.
+class Manifest:
+    def __init__(self, root=SKELETON_DIR):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_FILE)
+        previous = {'components': {}, 'files': {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                previous = json.load(f)
+        self.previous_components = previous['components']
+        self.previous_files = {}
+        for relpath, digest in previous['files'].items():
+            self.previous_files.setdefault(self.component_of(relpath), {})[relpath] = digest
+        self.components = {}
+        self.files = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def component_of(self, relpath):
+        return relpath.split('/')[0]
+
+    # Unchanged inputs and outputs that still hold what was generated: the component
+    # does not need rendering
+    def is_fresh(self, name, inputs):
+        if self.previous_components.get(name) != inputs:
+            return False
+        files = self.previous_files.get(name, {})
+        return bool(files) and all(file_hash(os.path.join(self.root, relpath)) == digest
+                                   for relpath, digest in files.items())
+
+    def carry_over(self, name):
+        with self.lock:
+            self.components[name] = self.previous_components[name]
+            self.files.update(self.previous_files[name])
+
+    def record_component(self, name, inputs):
+        with self.lock:
+            self.components[name] = inputs
+
+    # Returns True when the file on disk does not hold the content and has to be (re)written
+    def record_file(self, path, digest):
+        relpath = os.path.relpath(path, self.root).replace(os.sep, '/')
+        component = self.component_of(relpath)
+        changed = file_hash(path) != digest
+        with self.lock:
+            self.files[relpath] = digest
+            if changed:
+                self.dirty.add(component)
+        return changed
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({'components': self.components, 'files': self.files}, f, indent=2, sort_keys=True)
+
+# Buffers a generated file and only writes it to disk when its content changed
+class GeneratedFile(io.StringIO):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            content = self.getvalue()
+            if _manifest is None or _manifest.record_file(self.path, content_hash(content)):
+                with open(self.path, 'w') as f:
+                    f.write(content)
+        return super().__exit__(exc_type, exc_value, traceback)
+
+def as_flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+# transactions adds the table the payments of mqtp consumers are stored in
+def generate_database(name, transactions=False):
+
+    path = f'{SKELETON_DIR}/{name}'
     os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, 'init.sql'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'init.sql')) as f:
         f.write(textwrap.dedent("""
             CREATE TABLE IF NOT EXISTS systems (
                 id INT AUTO_INCREMENT PRIMARY KEY,
@@ -13,12 +127,23 @@ def generate_database(name):
             );
             """
         ))
+        if transactions:
+            f.write(textwrap.dedent("""
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    order_id VARCHAR(255) NOT NULL,
+                    amount DECIMAL(12, 2) NOT NULL,
+                    status VARCHAR(32) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                """
+            ))
         
-def generate_mqtp(name, database):
-    path = f'skeleton/{name}'
+def generate_mqtp(name, database, prefetch_count=100, batch_size=50, batch_timeout_ms=200, publish_timeout=5.0):
+    path = f'{SKELETON_DIR}/{name}'
     os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, 'app.py'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'app.py')) as f:
         f.write(textwrap.dedent(f"""
             from flask import Flask, request, jsonify
             import mysql.connector
@@ -26,9 +151,27 @@ def generate_mqtp(name, database):
             import threading
             import json
             import time
+            import collections
+            import uuid
+            from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
             app = Flask(__name__)
 
+            DB_CONFIG = {{
+                'host': '{database}',
+                'user': 'root',
+                'password': 'root',
+                'database': '{database}'
+            }}
+
+            # Consumer tuning: unacked messages buffered by RabbitMQ and insert batch limits
+            PREFETCH_COUNT = {prefetch_count}
+            BATCH_SIZE = {batch_size}
+            BATCH_TIMEOUT = {batch_timeout_ms} / 1000
+
+            # Seconds a request waits for the broker to confirm its payment
+            PUBLISH_TIMEOUT = {publish_timeout}
+
             # Setup RabbitMQ connection
             def setup_rabbitmq():
                 while True:
@@ -41,57 +184,253 @@ def generate_mqtp(name, database):
                         print(f"Failed to connect to RabbitMQ: {{e}}")
                         time.sleep(5)
 
-            def start_consumer():
-                connection, channel = setup_rabbitmq()
-                
-                def callback(ch, method, properties, body):
-                    payment_data = json.loads(body)
-                    process_payment(payment_data)
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                
-                channel.basic_consume(queue='payments', on_message_callback=callback)
-                print('Payment service started consuming')
+            # Long-lived database connection owned by the consumer thread
+            db_connection = None
+
+            def get_db_connection():
+                global db_connection
+                if db_connection is None:
+                    db_connection = mysql.connector.connect(**DB_CONFIG)
+                elif not db_connection.is_connected():
+                    db_connection.reconnect(attempts=3, delay=1)
+                return db_connection
+
+            # Errors caused by the data of a payment; any other error (the database being
+            # unreachable, a missing table) is not the payment's fault and it is redelivered
+            DATA_ERRORS = (mysql.connector.errors.DataError, mysql.connector.errors.IntegrityError)
+
+            # Decode a payment message, returning None when it cannot be stored
+            def parse_payment(body):
                 try:
-                    channel.start_consuming()
-                except Exception as e:
-                    print(f"Consumer error: {{e}}")
-                    connection.close()
-                    time.sleep(5)
-                    start_consumer()
-
-            def process_payment(payment_data):
-                conn = mysql.connector.connect(
-                    host='{database}',
-                    user='root',
-                    password='root',
-                    database='{database}'
-                )
+                    payment = json.loads(body)
+                except ValueError:
+                    return None
+                if not isinstance(payment, dict) or 'order_id' not in payment or 'amount' not in payment:
+                    return None
+                return payment
+
+            # Insert a batch of payments in a single transaction
+            def process_payments(payments):
+                conn = get_db_connection()
                 cursor = conn.cursor()
-                cursor.execute("INSERT INTO transactions (order_id, amount, status) VALUES (%s, %s, %s)", 
-                              (payment_data['order_id'], payment_data['amount'], 'processed'))
-                conn.commit()
-                cursor.close()
-                conn.close()
+                try:
+                    cursor.executemany("INSERT INTO transactions (order_id, amount, status) VALUES (%s, %s, %s)",
+                                       [(p['order_id'], p['amount'], 'processed') for p in payments])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+
+            # Commit the pending batch, then ack every message in it with a single frame
+            def flush_batch(channel, batch):
+                last_tag = batch[-1][0]
+                try:
+                    process_payments([payment for _, payment in batch])
+                    channel.basic_ack(delivery_tag=last_tag, multiple=True)
+                except DATA_ERRORS as e:
+                    print(f"Failed to store batch of {{len(batch)}} payments, retrying one by one: {{e}}")
+                    flush_one_by_one(channel, batch)
+                except Exception as e:
+                    print(f"Failed to store batch of {{len(batch)}} payments, requeueing it: {{e}}")
+                    channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+                    time.sleep(1)
+                batch.clear()
+
+            # Store each payment of a batch with bad data on its own, so only the payments
+            # the database refuses are rejected instead of redelivering the batch forever
+            def flush_one_by_one(channel, batch):
+                for i, (tag, payment) in enumerate(batch):
+                    try:
+                        process_payments([payment])
+                    except DATA_ERRORS as e:
+                        print(f"Discarding payment the database refused: {{payment!r}}: {{e}}")
+                        channel.basic_reject(delivery_tag=tag, requeue=False)
+                    except Exception as e:
+                        print(f"Failed to store payment, requeueing {{len(batch) - i}} payments: {{e}}")
+                        for remaining_tag, _ in batch[i:]:
+                            channel.basic_nack(delivery_tag=remaining_tag, requeue=True)
+                        time.sleep(1)
+                        return
+                    else:
+                        channel.basic_ack(delivery_tag=tag)
+
+            def start_consumer():
+                while True:
+                    connection, channel = setup_rabbitmq()
+                    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+                    print('Payment service started consuming')
+
+                    batch = []
+                    batch_started = None
+                    try:
+                        # Yields (None, None, None) after BATCH_TIMEOUT without messages
+                        for method, properties, body in channel.consume('payments', inactivity_timeout=BATCH_TIMEOUT):
+                            if method is not None:
+                                payment = parse_payment(body)
+                                if payment is None:
+                                    print(f"Discarding malformed payment message: {{body!r}}")
+                                    channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+                                else:
+                                    if not batch:
+                                        batch_started = time.monotonic()
+                                    batch.append((method.delivery_tag, payment))
+                            if batch and (len(batch) >= BATCH_SIZE or method is None
+                                          or time.monotonic() - batch_started >= BATCH_TIMEOUT):
+                                flush_batch(channel, batch)
+                    except Exception as e:
+                        # Unacked messages are redelivered by RabbitMQ once the connection closes
+                        print(f"Consumer error: {{e}}")
+                        try:
+                            connection.close()
+                        except Exception:
+                            pass
+                        time.sleep(5)
+
+            class PublishOutcomeUnknown(Exception):
+                pass
+
+            # Keeps one AMQP connection and channel open on its own IO loop thread.
+            # Request threads hand messages over through an outbox; the broker confirms
+            # them asynchronously (often many at once) and every publish waits on a Future.
+            class PaymentPublisher:
+                def __init__(self, host, queue):
+                    self.host = host
+                    self.queue = queue
+                    self.connection = None
+                    self.channel = None
+                    self.outbox = collections.deque()
+                    self.pending = {{}}
+                    self.delivery_tag = 0
+
+                def start(self):
+                    thread = threading.Thread(target=self._run)
+                    thread.daemon = True
+                    thread.start()
+
+                # Raises PublishOutcomeUnknown when the message was sent but not confirmed in
+                # time; a message still in the outbox is withdrawn and never sent
+                def publish(self, body, timeout):
+                    future = Future()
+                    self.outbox.append((body, future))
+                    self._wake()
+                    try:
+                        return future.result(timeout=timeout)
+                    except FutureTimeoutError:
+                        if future.cancel():
+                            raise TimeoutError("broker unavailable")
+                        raise PublishOutcomeUnknown("sent but not confirmed by the broker in time")
+
+                def _wake(self):
+                    connection = self.connection
+                    if connection is not None:
+                        try:
+                            connection.ioloop.add_callback_threadsafe(self._drain)
+                        except Exception:
+                            pass  # Reconnecting; the outbox is drained once the channel is ready
+
+                def _run(self):
+                    while True:
+                        self.connection = pika.SelectConnection(
+                            pika.ConnectionParameters(host=self.host),
+                            on_open_callback=self._on_connection_open,
+                            on_open_error_callback=self._on_connection_error,
+                            on_close_callback=self._on_connection_closed)
+                        self.connection.ioloop.start()
+                        time.sleep(5)
+
+                def _on_connection_open(self, connection):
+                    connection.channel(on_open_callback=self._on_channel_open)
+
+                def _on_connection_error(self, connection, error):
+                    print(f"Failed to connect to RabbitMQ: {{error}}")
+                    connection.ioloop.stop()
+
+                def _on_connection_closed(self, connection, reason):
+                    print(f"Publisher connection closed: {{reason}}")
+                    self.channel = None
+                    # Unconfirmed messages are published again on the next channel
+                    for tag in sorted(self.pending, reverse=True):
+                        self.outbox.appendleft(self.pending.pop(tag))
+                    connection.ioloop.stop()
+
+                def _on_channel_open(self, channel):
+                    channel.add_on_close_callback(self._on_channel_closed)
+                    channel.queue_declare(queue=self.queue, durable=True,
+                                          callback=lambda frame: self._on_queue_declared(channel))
+
+                # A closed channel loses its delivery tags, so start over with a fresh connection
+                def _on_channel_closed(self, channel, reason):
+                    self.channel = None
+                    if self.connection.is_open:
+                        self.connection.close()
+
+                def _on_queue_declared(self, channel):
+                    channel.confirm_delivery(self._on_delivery_confirmation)
+                    self.delivery_tag = 0
+                    self.channel = channel
+                    self._drain()
+
+                # Runs on the IO loop thread: one frame write per queued message
+                def _drain(self):
+                    while self.channel is not None and self.channel.is_open and self.outbox:
+                        body, future = self.outbox.popleft()
+                        # Skip messages withdrawn by a timed out request. Once running the
+                        # future can no longer be cancelled; requeued messages already are.
+                        if not future.running() and not future.set_running_or_notify_cancel():
+                            continue
+                        self.channel.basic_publish(
+                            exchange='',
+                            routing_key=self.queue,
+                            body=body,
+                            properties=pika.BasicProperties(
+                                delivery_mode=2,  # make message persistent
+                            ))
+                        self.delivery_tag += 1
+                        self.pending[self.delivery_tag] = (body, future)
+
+                def _on_delivery_confirmation(self, frame):
+                    method = frame.method
+                    acked = isinstance(method, pika.spec.Basic.Ack)
+                    if method.multiple:
+                        tags = [tag for tag in self.pending if tag <= method.delivery_tag]
+                    else:
+                        tags = [method.delivery_tag]
+                    for tag in tags:
+                        body, future = self.pending.pop(tag)
+                        if acked:
+                            future.set_result(True)
+                        else:
+                            future.set_exception(RuntimeError("Payment rejected by the broker"))
+
+            publisher = PaymentPublisher(host='rabbitmq', queue='payments')
 
             @app.route('/process', methods=['POST'])
             def queue_payment():
                 data = request.json
-                connection, channel = setup_rabbitmq()
-                channel.basic_publish(
-                    exchange='',
-                    routing_key='payments',
-                    body=json.dumps(data),
-                    properties=pika.BasicProperties(
-                        delivery_mode=2,  # make message persistent
-                    ))
-                connection.close()
-                return jsonify(status="payment queued")
+                # Travels with the payment so a client retrying after an unknown outcome can
+                # send the same key and the duplicate can be recognised
+                idempotency_key = request.headers.get('Idempotency-Key') or str(uuid.uuid4())
+                if isinstance(data, dict):
+                    data = dict(data, idempotency_key=idempotency_key)
+                try:
+                    publisher.publish(json.dumps(data), timeout=PUBLISH_TIMEOUT)
+                except PublishOutcomeUnknown as e:
+                    return jsonify(status="payment outcome unknown", error=str(e),
+                                   idempotency_key=idempotency_key), 202
+                except Exception as e:
+                    return jsonify(status="payment not queued", error=str(e) or "timed out"), 503
+                return jsonify(status="payment queued", idempotency_key=idempotency_key)
 
             @app.route('/health')
             def health():
                 return jsonify(status="ok")
 
             if __name__ == '__main__':
+                # Start the long-lived publisher used by /process
+                publisher.start()
+
                 # Start consumer in a separate thread
                 consumer_thread = threading.Thread(target=start_consumer)
                 consumer_thread.daemon = True
@@ -102,7 +441,7 @@ def generate_mqtp(name, database):
             """
         ))
 
-    with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'Dockerfile')) as f:
         f.write(textwrap.dedent("""
             FROM python:3.11-slim
                                 
@@ -115,55 +454,120 @@ def generate_mqtp(name, database):
         ))
 
 
-def generate_backend(name, database):
+MAX_POOL_SIZE = 32  # mysql-connector refuses larger pools
+
 
-    path = f'skeleton/{name}'
+def generate_backend(name, database, pool_size=5, pool_timeout=5.0):
+    pool_size = int(pool_size)
+    if not 1 <= pool_size <= MAX_POOL_SIZE:
+        raise ValueError(f"pool_size of {name} must be between 1 and {MAX_POOL_SIZE}, got {pool_size}")
+
+    path = f'{SKELETON_DIR}/{name}'
     os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, 'app.py'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'app.py')) as f:
         f.write(textwrap.dedent(f"""
             from flask import Flask, request, jsonify
             import mysql.connector
+            from mysql.connector import pooling
+            import threading
 
             app = Flask(__name__)
 
+            DB_CONFIG = {{
+                'host': '{database}',
+                'user': 'root',
+                'password': 'root',
+                'database': '{database}'
+            }}
+            POOL_SIZE = {pool_size}
+            # Seconds a request waits for a free connection before failing
+            POOL_TIMEOUT = {pool_timeout}
+
+            # One connection pool per process, created lazily on first use
+            _pool = None
+            _pool_lock = threading.Lock()
+            # The pool raises PoolError as soon as it is exhausted, so requests take a
+            # slot first and wait for a connection to be returned instead
+            _pool_slots = threading.BoundedSemaphore(POOL_SIZE)
+
+            def get_pool():
+                global _pool
+                if _pool is None:
+                    with _pool_lock:
+                        if _pool is None:
+                            _pool = pooling.MySQLConnectionPool(
+                                pool_name='{name}_pool',
+                                pool_size=POOL_SIZE,
+                                pool_reset_session=True,
+                                **DB_CONFIG
+                            )
+                return _pool
+
+            # Check out a pooled connection, reconnecting it if the server dropped it.
+            # Every connection returned must be given back with release_connection().
+            def get_connection():
+                if not _pool_slots.acquire(timeout=POOL_TIMEOUT):
+                    raise mysql.connector.errors.PoolError(f"No connection free after {{POOL_TIMEOUT}} s")
+                conn = None
+                try:
+                    conn = get_pool().get_connection()
+                    if not conn.is_connected():
+                        conn.reconnect(attempts=3, delay=1)
+                    return conn
+                except Exception:
+                    if conn is not None:
+                        conn.close()
+                    _pool_slots.release()
+                    raise
+
+            # Return the connection to the pool instead of closing the socket, and free its slot
+            def release_connection(conn):
+                try:
+                    conn.close()
+                finally:
+                    _pool_slots.release()
+
+            # Run a query on a pooled connection, retrying once on a broken connection
+            def run_query(query, params=(), fetch=False, retries=1):
+                for attempt in range(retries + 1):
+                    conn = get_connection()
+                    try:
+                        cursor = conn.cursor()
+                        cursor.execute(query, params)
+                        rows = cursor.fetchall() if fetch else None
+                        if not fetch:
+                            conn.commit()
+                        cursor.close()
+                        return rows
+                    except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError) as e:
+                        print(f"Database connection error (attempt {{attempt + 1}}): {{e}}")
+                        if attempt == retries:
+                            raise
+                    finally:
+                        release_connection(conn)
+
             @app.route('/create', methods=['POST'])
             def create():
                 data = request.json
-                conn = mysql.connector.connect(
-                    host='{database}',
-                    user='root',
-                    password='root',
-                    database='{database}'
-                )
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO systems (name) VALUES (%s)", (data['name'],))
-                conn.commit()
-                cursor.close()
-                conn.close()
+                run_query("INSERT INTO systems (name) VALUES (%s)", (data['name'],))
                 return jsonify(status="created")
 
             @app.route('/systems')
             def get_systems():
-                conn = mysql.connector.connect(
-                    host='{database}',
-                    user='root',
-                    password='root',
-                    database='{database}'
-                )
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM systems")
-                rows = cursor.fetchall()
-                cursor.close()
-                conn.close()
+                rows = run_query("SELECT * FROM systems", fetch=True)
                 return jsonify(systems=rows)
 
+            @app.route('/health')
+            def health():
+                return jsonify(status="ok")
+
             if __name__ == '__main__':
                 app.run(host='0.0.0.0', port=80)
             """
         ))
 
-    with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'Dockerfile')) as f:
         f.write(textwrap.dedent("""
             FROM python:3.11-slim
                                 
@@ -178,10 +582,10 @@ def generate_backend(name, database):
 
 def generate_frontend(name, api_gateway):
     
-    path = f'skeleton/{name}'
+    path = f'{SKELETON_DIR}/{name}'
     os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, 'package.json'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'package.json')) as f:
         f.write(textwrap.dedent("""
             {
                 "name": "frontend",
@@ -195,7 +599,7 @@ def generate_frontend(name, api_gateway):
             """
         ))
 
-    with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'Dockerfile')) as f:
         f.write(textwrap.dedent("""
             FROM node:18
                                 
@@ -207,7 +611,7 @@ def generate_frontend(name, api_gateway):
             """
         ))
 
-    with open(os.path.join(path, 'app.js'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'app.js')) as f:
         f.write(textwrap.dedent(f"""
             const express = require('express');
             const axios = require('axios');
@@ -259,11 +663,11 @@ def generate_frontend(name, api_gateway):
             """
         ))
 
-def generate_load_balancer(name, frontend_name):
-    path = f'skeleton/{name}'
+def generate_load_balancer(name, frontends):
+    path = f'{SKELETON_DIR}/{name}'
     os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'Dockerfile')) as f:
         f.write(textwrap.dedent("""
             FROM nginx:alpine
 
@@ -274,7 +678,10 @@ def generate_load_balancer(name, frontend_name):
             CMD ["nginx", "-g", "daemon off;"]
         """))
 
-    with open(os.path.join(path, 'nginx.conf'), 'w') as f:
+    # One upstream server per frontend, dedented with the rest of the template
+    servers = '\n                    '.join(f"server {frontend}:80;" for frontend in frontends)
+
+    with GeneratedFile(os.path.join(path, 'nginx.conf')) as f:
         f.write(textwrap.dedent(f"""
             worker_processes auto;
 
@@ -284,7 +691,7 @@ def generate_load_balancer(name, frontend_name):
 
             http {{
                 upstream frontend {{
-                    server {frontend_name}:80;
+                    {servers}
                 }}
 
                 server {{
@@ -306,20 +713,73 @@ def generate_load_balancer(name, frontend_name):
             }}
         """))
         
-def generate_api_gateway(name, backends):
-    path = f'skeleton/{name}'
+def generate_api_gateway(name, backends, databases=None, max_connections=100, max_keepalive_connections=20,
+                         keepalive_expiry=5.0, timeout=10.0, connect_timeout=2.0, http2=False,
+                         proxy_mode='json', lb_strategy='round_robin', endpoint_strategies=None,
+                         service_weights=None, health_check_interval=10.0, unhealthy_threshold=2):
+    endpoint_strategies = endpoint_strategies or {}
+    service_weights = service_weights or {}
+    for strategy in [lb_strategy, *endpoint_strategies.values()]:
+        if strategy not in LB_STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy '{strategy}' for {name}, "
+                             f"expected one of {', '.join(LB_STRATEGIES)}")
+    if proxy_mode not in PROXY_MODES:
+        raise ValueError(f"Unknown proxy mode '{proxy_mode}' for {name}, "
+                         f"expected one of {', '.join(PROXY_MODES)}")
+
+    # Backends serve the system endpoints and mqtp components take the payments.
+    # /systems and /create are balanced only over the backends sharing the database
+    # of the first backend, so every system is created in and listed from one store;
+    # the other backends stay reachable through /<service>/<path>.
+    system_backends = [service for service, ctype in backends.items() if ctype == 'backend']
+    if databases and system_backends:
+        store = set(databases.get(system_backends[0], []))
+        system_backends = [service for service in system_backends
+                           if store & set(databases.get(service, []))]
+    service_registry = {
+        'systems': system_backends,
+        'create': list(system_backends),
+        'process': [service for service, ctype in backends.items() if ctype == 'mqtp'],
+    }
+    service_routes = {service: f'http://{service}:80' for service in backends}
+
+    path = f'{SKELETON_DIR}/{name}'
     os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, 'app.py'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'app.py')) as f:
         f.write(textwrap.dedent(f"""
             from fastapi import FastAPI, Request, HTTPException
+            from fastapi.responses import StreamingResponse
+            from starlette.background import BackgroundTask
             import httpx
+            import asyncio
+            import itertools
             import random
+            import time
+            from contextlib import asynccontextmanager
             from fastapi.middleware.cors import CORSMiddleware
             import uvicorn
 
             app = FastAPI(title="E-commerce API Gateway")
 
+            # Upstream HTTP client settings
+            HTTP_LIMITS = httpx.Limits(
+                max_connections={max_connections},
+                max_keepalive_connections={max_keepalive_connections},
+                keepalive_expiry={keepalive_expiry},
+            )
+            HTTP_TIMEOUT = httpx.Timeout({timeout}, connect={connect_timeout})
+            HTTP2 = {bool(http2)}
+
+            # 'json' parses and re-encodes payloads, 'stream' passes raw bytes through
+            PROXY_MODE = '{proxy_mode}'
+
+            # Connection specific headers that must not be forwarded by a proxy
+            HOP_BY_HOP_HEADERS = {{
+                'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                'te', 'trailers', 'transfer-encoding', 'upgrade', 'host'
+            }}
+
             # Add CORS middleware
             app.add_middleware(
                 CORSMiddleware,
@@ -330,32 +790,222 @@ def generate_api_gateway(name, backends):
             )
 
             # Service registry - mapping endpoints to available services
-            SERVICE_REGISTRY = {{
-                'systems': ['ecommerce_be_or', 'ecommerce_be_pd', 'ecommerce_be_inv'],
-                'create': ['ecommerce_be_or'], 
-                'process': ['ecommerce_be_pmt','ecommerce_be_pmt_rep']
-            }}
+            SERVICE_REGISTRY = {service_registry!r}
 
             # Define direct service routes
-            SERVICE_ROUTES = {{
-                'ecommerce_be_or': 'http://ecommerce_be_or:80',
-                'ecommerce_be_pd': 'http://ecommerce_be_pd:80',
-                'ecommerce_be_inv': 'http://ecommerce_be_inv:80',
-                'ecommerce_be_pmt': 'http://ecommerce_be_pmt:80'
-                'ecommerce_be_pmt_rep': 'http://ecommerce_be_pmt_rep:80'
+            SERVICE_ROUTES = {service_routes!r}
+
+            # Load balancing strategy per endpoint
+            DEFAULT_LB_STRATEGY = '{lb_strategy}'
+            LB_STRATEGIES = {endpoint_strategies!r}
+            SERVICE_WEIGHTS = {service_weights!r}
+            EWMA_DECAY = 0.3
+            HEALTH_CHECK_INTERVAL = {health_check_interval}
+            UNHEALTHY_THRESHOLD = {unhealthy_threshold}
+
+            # In-process view of an upstream: load, latency and health
+            class Upstream:
+                def __init__(self, name, weight=1):
+                    self.name = name
+                    self.weight = weight
+                    self.in_flight = 0
+                    self.ewma_latency = 0.0
+                    self.failures = 0
+                    self.healthy = True
+
+                def record_latency(self, latency):
+                    if self.ewma_latency == 0.0:
+                        self.ewma_latency = latency
+                    else:
+                        self.ewma_latency = EWMA_DECAY * latency + (1 - EWMA_DECAY) * self.ewma_latency
+
+            class RoundRobinSelector:
+                def __init__(self):
+                    self.counter = itertools.count()
+
+                def select(self, upstreams):
+                    return upstreams[next(self.counter) % len(upstreams)]
+
+            # Smooth weighted round-robin, as done by nginx
+            class WeightedSelector:
+                def __init__(self):
+                    self.current = {{}}
+
+                def select(self, upstreams):
+                    total = 0
+                    best = None
+                    for upstream in upstreams:
+                        self.current[upstream.name] = self.current.get(upstream.name, 0) + upstream.weight
+                        total += upstream.weight
+                        if best is None or self.current[upstream.name] > self.current[best.name]:
+                            best = upstream
+                    self.current[best.name] -= total
+                    return best
+
+            class LeastOutstandingSelector:
+                def select(self, upstreams):
+                    # Shuffle first so ties are not always broken in favour of the same upstream
+                    return min(random.sample(upstreams, len(upstreams)), key=lambda u: u.in_flight)
+
+            class PowerOfTwoSelector:
+                def select(self, upstreams):
+                    if len(upstreams) == 1:
+                        return upstreams[0]
+                    first, second = random.sample(upstreams, 2)
+                    return first if first.in_flight <= second.in_flight else second
+
+            class EwmaSelector:
+                def select(self, upstreams):
+                    return min(random.sample(upstreams, len(upstreams)),
+                               key=lambda u: u.ewma_latency * (u.in_flight + 1))
+
+            SELECTORS = {{
+                'round_robin': RoundRobinSelector,
+                'weighted': WeightedSelector,
+                'least_outstanding': LeastOutstandingSelector,
+                'power_of_two': PowerOfTwoSelector,
+                'ewma': EwmaSelector,
+            }}
+
+            UPSTREAMS = {{service: Upstream(service, SERVICE_WEIGHTS.get(service, 1)) for service in SERVICE_ROUTES}}
+            ENDPOINT_SELECTORS = {{
+                endpoint: SELECTORS[LB_STRATEGIES.get(endpoint, DEFAULT_LB_STRATEGY)]()
+                for endpoint in SERVICE_REGISTRY
             }}
 
-            # Select service using simple round-robin load balancing
+            # One keep-alive client per upstream, shared for the whole application lifetime
+            HTTP_CLIENTS = {{}}
+            BACKGROUND_TASKS = []
+
+            @app.on_event("startup")
+            async def open_http_clients():
+                for service, base_url in SERVICE_ROUTES.items():
+                    HTTP_CLIENTS[service] = httpx.AsyncClient(
+                        base_url=base_url,
+                        limits=HTTP_LIMITS,
+                        timeout=HTTP_TIMEOUT,
+                        http2=HTTP2,
+                    )
+                BACKGROUND_TASKS.append(asyncio.create_task(health_check_loop()))
+
+            @app.on_event("shutdown")
+            async def close_http_clients():
+                for task in BACKGROUND_TASKS:
+                    task.cancel()
+                BACKGROUND_TASKS.clear()
+                for client in HTTP_CLIENTS.values():
+                    await client.aclose()
+                HTTP_CLIENTS.clear()
+
+            # Probe every upstream, ejecting it after repeated failures and readmitting it on success
+            async def check_upstream(service):
+                upstream = UPSTREAMS[service]
+                try:
+                    response = await HTTP_CLIENTS[service].get('/health')
+                    ok = response.status_code == 200
+                except httpx.RequestError:
+                    ok = False
+                if ok:
+                    if not upstream.healthy:
+                        print(f"Upstream {{service}} is healthy again")
+                    upstream.failures = 0
+                    upstream.healthy = True
+                else:
+                    upstream.failures += 1
+                    if upstream.healthy and upstream.failures >= UNHEALTHY_THRESHOLD:
+                        print(f"Ejecting unhealthy upstream {{service}}")
+                        upstream.healthy = False
+
+            async def health_check_loop():
+                while True:
+                    await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+                    await asyncio.gather(*(check_upstream(service) for service in HTTP_CLIENTS))
+
+            # Count in-flight requests and latency of every call to an upstream
+            def start_upstream_call(service):
+                upstream = UPSTREAMS[service]
+                upstream.in_flight += 1
+                return upstream, time.perf_counter()
+
+            def finish_upstream_call(call):
+                upstream, start = call
+                upstream.in_flight -= 1
+                upstream.record_latency(time.perf_counter() - start)
+
+            @asynccontextmanager
+            async def track_upstream(service):
+                call = start_upstream_call(service)
+                try:
+                    yield
+                finally:
+                    finish_upstream_call(call)
+
+            # Select a healthy service using the endpoint's load balancing strategy
             def get_service_for_endpoint(endpoint):
                 services = SERVICE_REGISTRY.get(endpoint)
                 if not services:
                     return None
-                return random.choice(services)
+                candidates = [UPSTREAMS[service] for service in services if UPSTREAMS[service].healthy]
+                if not candidates:
+                    raise HTTPException(status_code=503, detail=f"No healthy service for '{{endpoint}}'")
+                return ENDPOINT_SELECTORS[endpoint].select(candidates).name
+
+            # Pass-through proxy: bodies are streamed as raw bytes in both directions
+            async def stream_request(target_service, request: Request, path: str):
+                method = request.method
+                headers = {{k: v for k, v in request.headers.items() if k not in HOP_BY_HOP_HEADERS}}
+                content = request.stream() if method in ["POST", "PUT", "PATCH"] else None
+                
+                client = HTTP_CLIENTS[target_service]
+                upstream_request = client.build_request(
+                    method, f"/{{path}}", content=content, params=request.query_params, headers=headers)
+                # The call lasts until the body has been relayed, not just until the headers arrive
+                call = start_upstream_call(target_service)
+                try:
+                    response = await client.send(upstream_request, stream=True)
+                except httpx.RequestError as e:
+                    finish_upstream_call(call)
+                    raise HTTPException(status_code=503, detail=f"Service unavailable: {{str(e)}}")
+                except BaseException:
+                    finish_upstream_call(call)
+                    raise
+
+                finished = False
+
+                async def close_upstream():
+                    nonlocal finished
+                    if finished:
+                        return
+                    finished = True
+                    try:
+                        await response.aclose()
+                    finally:
+                        finish_upstream_call(call)
+
+                # Also close from the body iterator, since the background task does not
+                # run when the client disconnects mid-stream
+                async def relay_body():
+                    try:
+                        async for chunk in response.aiter_raw():
+                            yield chunk
+                    finally:
+                        await close_upstream()
+                
+                response_headers = {{k: v for k, v in response.headers.items() if k not in HOP_BY_HOP_HEADERS}}
+                return StreamingResponse(
+                    relay_body(),
+                    status_code=response.status_code,
+                    headers=response_headers,
+                    background=BackgroundTask(close_upstream),
+                )
 
             # Generic route handler for proxying requests
             async def proxy_request(target_service, request: Request, path: str):
                 method = request.method
-                target_url = f"{{SERVICE_ROUTES[target_service]}}/{{path}}"
+                if method not in ["GET", "POST", "PUT", "DELETE", "PATCH"]:
+                    raise HTTPException(status_code=405, detail="Method not allowed")
+                if PROXY_MODE == 'stream':
+                    return await stream_request(target_service, request, path)
                 
                 # Get request body for methods that might have one
                 body = None
@@ -365,30 +1015,19 @@ def generate_api_gateway(name, backends):
                 # Get query parameters
                 params = dict(request.query_params)
                 
-                # Get headers (excluding host)
+                # Get headers (excluding host and the length of the original body)
                 headers = dict(request.headers)
-                if "host" in headers:
-                    del headers["host"]
+                headers.pop("host", None)
+                headers.pop("content-length", None)
                 
-                # Create httpx client
-                async with httpx.AsyncClient() as client:
-                    try:
-                        if method == "GET":
-                            response = await client.get(target_url, params=params, headers=headers)
-                        elif method == "POST":
-                            response = await client.post(target_url, json=body, params=params, headers=headers)
-                        elif method == "PUT":
-                            response = await client.put(target_url, json=body, params=params, headers=headers)
-                        elif method == "DELETE":
-                            response = await client.delete(target_url, params=params, headers=headers)
-                        elif method == "PATCH":
-                            response = await client.patch(target_url, json=body, params=params, headers=headers)
-                        else:
-                            raise HTTPException(status_code=405, detail="Method not allowed")
-                        
-                        return response.json()
-                    except httpx.RequestError as e:
-                        raise HTTPException(status_code=503, detail=f"Service unavailable: {{str(e)}}")
+                # Reuse the pooled keep-alive client of the upstream
+                client = HTTP_CLIENTS[target_service]
+                try:
+                    async with track_upstream(target_service):
+                        response = await client.request(method, f"/{{path}}", json=body, params=params, headers=headers)
+                    return response.json()
+                except httpx.RequestError as e:
+                    raise HTTPException(status_code=503, detail=f"Service unavailable: {{str(e)}}")
 
             @app.get("/systems")
             async def get_systems(request: Request):
@@ -412,7 +1051,7 @@ def generate_api_gateway(name, backends):
                 return await proxy_request(service, request, "process")
 
             # Dynamic service routes
-           @app.api_route("/{{service}}/{{path:path}}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+            @app.api_route("/{{service}}/{{path:path}}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
             async def service_routes(service: str, path: str, request: Request):
                 if service not in SERVICE_ROUTES:
                     raise HTTPException(status_code=404, detail=f"Service '{{service}}' not found")
@@ -427,33 +1066,36 @@ def generate_api_gateway(name, backends):
             """
         ))
 
-    with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'Dockerfile')) as f:
         f.write(textwrap.dedent("""
             FROM python:3.11-slim
             
             WORKDIR /app
             COPY . .
             
-            RUN pip install fastapi uvicorn httpx
+            RUN pip install fastapi uvicorn "httpx[http2]"
             
             CMD ["uvicorn", "app:app", "--host", "0.0.0.0", "--port", "80"]
             """
         ))
 
     # Add requirements.txt for clarity
-    with open(os.path.join(path, 'requirements.txt'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'requirements.txt')) as f:
         f.write(textwrap.dedent("""
             fastapi==0.104.1
             uvicorn==0.23.2
-            httpx==0.25.1
+            httpx[http2]==0.25.1
             """
         ))
 
-def generate_docker_compose(components):
-    path = f'skeleton/'
+# upstreams maps each api_gateway, frontend and load_balancer to the services it forwards to
+def generate_docker_compose(components, databases=None, upstreams=None):
+    databases = databases or {}
+    upstreams = upstreams or {}
+    path = f'{SKELETON_DIR}/'
     os.makedirs(path, exist_ok=True)
 
-    with open(os.path.join(path, 'docker-compose.yml'), 'w') as f:
+    with GeneratedFile(os.path.join(path, 'docker-compose.yml')) as f:
         # Order components by type for proper dependency management
         sorted_components = {}
         for name, ctype in components.items():
@@ -504,10 +1146,9 @@ def generate_docker_compose(components):
                 f.write(f"    build: ./{name}\n")
                 f.write("    depends_on:\n")
                 # Find database connections
-                for db_name in sorted_components.get("database", []):
-                    if db_name.startswith(name):
-                        f.write(f"      {db_name}:\n")
-                        f.write("        condition: service_healthy\n")
+                for db_name in databases.get(name, []):
+                    f.write(f"      {db_name}:\n")
+                    f.write("        condition: service_healthy\n")
                 f.write("    healthcheck:\n")
                 f.write("      test: wget --no-verbose --tries=1 --spider http://localhost:80/health || exit 1\n")
                 f.write("      interval: 30s\n")
@@ -525,24 +1166,21 @@ def generate_docker_compose(components):
                 f.write("      rabbitmq:\n")
                 f.write("        condition: service_healthy\n")
                 # Find database connections
-                for db_name in sorted_components.get("database", []):
-                    if db_name.startswith(name):
-                        f.write(f"      {db_name}:\n")
-                        f.write("        condition: service_healthy\n")
+                for db_name in databases.get(name, []):
+                    f.write(f"      {db_name}:\n")
+                    f.write("        condition: service_healthy\n")
                 f.write("    healthcheck:\n")
                 f.write("      test: wget --no-verbose --tries=1 --spider http://localhost:80/health || exit 1\n")
                 f.write("      interval: 30s\n")
                 f.write("      timeout: 10s\n")
                 f.write("      retries: 5\n\n")
 
-        # API Gateway
-        api_gateway_name = None
-        if "api_gateway" in sorted_components:
-            api_gateway_name = sorted_components["api_gateway"][0]
-            f.write(f"  {api_gateway_name}:\n")
-            f.write(f"    build: ./{api_gateway_name}\n")
+        # API Gateways
+        for name in sorted_components.get("api_gateway", []):
+            f.write(f"  {name}:\n")
+            f.write(f"    build: ./{name}\n")
             f.write("    depends_on:\n")
-            for service in backend_services + mqtp_services:
+            for service in upstreams.get(name, backend_services + mqtp_services):
                 f.write(f"      {service}:\n")
                 f.write("        condition: service_healthy\n")
             f.write("    healthcheck:\n")
@@ -551,80 +1189,161 @@ def generate_docker_compose(components):
             f.write("      timeout: 10s\n")
             f.write("      retries: 5\n\n")
 
-        # Frontend
-        frontend_name = None
-        if "frontend" in sorted_components:
-            frontend_name = sorted_components["frontend"][0]
-            f.write(f"  {frontend_name}:\n")
-            f.write(f"    build: ./{frontend_name}\n")
+        # Frontends
+        for name in sorted_components.get("frontend", []):
+            f.write(f"  {name}:\n")
+            f.write(f"    build: ./{name}\n")
             f.write("    depends_on:\n")
-            f.write(f"      {api_gateway_name}:\n")
-            f.write("        condition: service_healthy\n")
+            for api_gateway_name in upstreams.get(name, sorted_components.get("api_gateway", [])[:1]):
+                f.write(f"      {api_gateway_name}:\n")
+                f.write("        condition: service_healthy\n")
             f.write("    healthcheck:\n")
             f.write("      test: wget --no-verbose --tries=1 --spider http://localhost:80/health || exit 1\n")
             f.write("      interval: 30s\n")
             f.write("      timeout: 10s\n")
             f.write("      retries: 5\n\n")
 
-        # Load Balancer
-        if "load_balancer" in sorted_components:
-            load_balancer_name = sorted_components["load_balancer"][0]
-            f.write(f"  {load_balancer_name}:\n")
-            f.write(f"    build: ./{load_balancer_name}\n")
+        # Load Balancers, published on 8080, 8081, ...
+        for i, name in enumerate(sorted_components.get("load_balancer", [])):
+            f.write(f"  {name}:\n")
+            f.write(f"    build: ./{name}\n")
             f.write("    ports:\n")
-            f.write("      - '8080:80'\n")
+            f.write(f"      - '{8080 + i}:80'\n")
             f.write("    depends_on:\n")
-            f.write(f"      {frontend_name}:\n")
-            f.write("        condition: service_healthy\n\n")
+            for frontend_name in upstreams.get(name, sorted_components.get("frontend", [])[:1]):
+                f.write(f"      {frontend_name}:\n")
+                f.write("        condition: service_healthy\n")
+            f.write("\n")
 
         f.write("\nnetworks:\n  default:\n    driver: bridge\n")
 
 
-def apply_transformations(model):
-
-    components = {}
-    connectors = {}
-    api_gateway_name = None
-    backend_name = None
-    database_name = None
-    frontend_name = None
-
-    for e in model.elements:
-        if e.__class__.__name__ == 'Component':
-            components[e.name] = e.type
-            if e.type == 'api_gateway':
-                api_gateway_name = e.name
-            elif e.type == 'frontend':
-                frontend_name = e.name
-
-     
-    backend_components = {}
-    for name, ctype in components.items():
+def apply_transformations(model, workers=1):
+
+    graph = ArchitectureGraph(model)
+    components = graph.components
+    settings = graph.settings
+    databases = {name: graph.targets(name, 'db_connector', 'database') for name in components}
+
+    # What each component forwards requests to, resolved from its http connectors:
+    # a gateway reaches its services directly or through a load balancer, a frontend
+    # calls the gateway it connects to, and a load balancer fronts the frontends it
+    # connects to or that reach it
+    upstreams = {}
+    for name in graph.of_type('api_gateway'):
+        upstreams[name] = [service for service in graph.reachable(name, 'http')
+                           if components[service] in ('backend', 'mqtp')]
+    for name in graph.of_type('frontend'):
+        upstreams[name] = graph.targets(name, 'http', 'api_gateway')
+    for name in graph.of_type('load_balancer'):
+        upstreams[name] = (graph.targets(name, 'http', 'frontend')
+                           or graph.reaching(name, 'http', 'frontend'))
+
+    problems = {name: "has no db_connector to a database"
+                for name in graph.of_type('backend') + graph.of_type('mqtp') if not databases[name]}
+    problems.update({name: "has no http connector to an api_gateway"
+                     for name in graph.of_type('frontend') if not upstreams[name]})
+    problems.update({name: "is not connected to a frontend over http"
+                     for name in graph.of_type('load_balancer') if not upstreams[name]})
+    if problems:
+        raise ModelValidationError(problems)
+
+    # Plan every generator call before rendering anything, dependencies first
+    jobs = []
+    for name in graph.order:
+        ctype = components[name]
         if ctype == 'database':
-            generate_database(name)
+            # Databases of mqtp consumers also store their payments
+            jobs.append((name, generate_database, dict(
+                name=name, transactions=bool(graph.sources(name, 'db_connector', 'mqtp')))))
         elif ctype == 'backend':
-            db_name = None
-            if name in connectors:
-                for conn in connectors[name]:
-                    if components[conn['to']] == 'database' and conn['type'] == 'db_connector':
-                        db_name = conn['to']
-                        break
-            generate_backend(name, database=db_name)
-            backend_components[name] = ctype
+            db_name = graph.target(name, 'db_connector', 'database')
+            jobs.append((name, generate_backend, dict(
+                name=name, database=db_name,
+                pool_size=settings[name].get('pool_size', 5),
+                pool_timeout=settings[name].get('pool_timeout', 5.0))))
         elif ctype == 'mqtp':
-            db_name = None
-            if name in connectors:
-                for conn in connectors[name]:
-                    if components[conn['to']] == 'database' and conn['type'] == 'db_connector':
-                        db_name = conn['to']
-                        break
-            generate_mqtp(name, database=db_name)
-            backend_components[name] = ctype
+            db_name = graph.target(name, 'db_connector', 'database')
+            jobs.append((name, generate_mqtp, dict(
+                name=name, database=db_name,
+                prefetch_count=settings[name].get('prefetch_count', 100),
+                batch_size=settings[name].get('batch_size', 50),
+                batch_timeout_ms=settings[name].get('batch_timeout_ms', 200),
+                publish_timeout=settings[name].get('publish_timeout', 5.0))))
         elif ctype == 'frontend':
-            generate_frontend(name, api_gateway=api_gateway_name)
+            jobs.append((name, generate_frontend, dict(name=name, api_gateway=upstreams[name][0])))
         elif ctype == 'api_gateway':
-            generate_api_gateway(name, backend_components)
+            gateway_settings = settings[name]
+            jobs.append((name, generate_api_gateway, dict(
+                name=name,
+                backends={service: components[service] for service in upstreams[name]},
+                databases={service: databases[service] for service in upstreams[name]},
+                max_connections=gateway_settings.get('max_connections', 100),
+                max_keepalive_connections=gateway_settings.get('max_keepalive_connections', 20),
+                keepalive_expiry=gateway_settings.get('keepalive_expiry', 5.0),
+                timeout=gateway_settings.get('timeout', 10.0),
+                connect_timeout=gateway_settings.get('connect_timeout', 2.0),
+                http2=as_flag(gateway_settings.get('http2', False)),
+                proxy_mode=gateway_settings.get('proxy_mode', 'json'),
+                lb_strategy=gateway_settings.get('lb_strategy', 'round_robin'),
+                endpoint_strategies={key[len('lb_'):]: value for key, value in gateway_settings.items()
+                                     if key.startswith('lb_') and key != 'lb_strategy'},
+                service_weights={service: values['weight'] for service, values in settings.items()
+                                 if 'weight' in values},
+                health_check_interval=gateway_settings.get('health_check_interval', 10.0),
+                unhealthy_threshold=gateway_settings.get('unhealthy_threshold', 2),
+            )))
         elif ctype == 'load_balancer':
-            generate_load_balancer(name, frontend_name=frontend_name)
-
-    generate_docker_compose(components)
\ No newline at end of file
+            jobs.append((name, generate_load_balancer, dict(name=name, frontends=upstreams[name])))
+
+    jobs.append(('docker-compose.yml', generate_docker_compose, dict(
+        components=components, databases=databases, upstreams=upstreams)))
+
+    return run_jobs(jobs, workers=workers)
+
+
+# Render one planned component unless its inputs and outputs are unchanged
+def run_job(manifest, name, generator, kwargs):
+    inputs = content_hash(json.dumps([GENERATOR_HASH, generator.__name__, kwargs], sort_keys=True, default=str))
+    if manifest.is_fresh(name, inputs):
+        manifest.carry_over(name)
+        return
+    generator(**kwargs)
+    manifest.record_component(name, inputs)
+
+# Render the planned components, optionally on a pool of worker threads.
+# Every component writes its own files, so the output does not depend on the
+# scheduling order. Returns the names of the components with rewritten files.
+def run_jobs(jobs, workers=1):
+    global _manifest
+    _manifest = manifest = Manifest()
+    errors = {}
+    try:
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {name: pool.submit(run_job, manifest, name, generator, kwargs)
+                           for name, generator, kwargs in jobs}
+                for name, future in futures.items():
+                    error = future.exception()
+                    if error is not None:
+                        errors[name] = error
+        else:
+            for name, generator, kwargs in jobs:
+                try:
+                    run_job(manifest, name, generator, kwargs)
+                except Exception as error:
+                    errors[name] = error
+        # Failed components are left out of the manifest so the next run retries them
+        manifest.save()
+    finally:
+        _manifest = None
+
+    if errors:
+        raise GenerationError(errors)
+
+    dirty = sorted(manifest.dirty)
+    if dirty:
+        print(f"Regenerated {len(dirty)} of {len(jobs)} components: {', '.join(dirty)}")
+    else:
+        print(f"All {len(jobs)} components are up to date")
+    return dirty
\ No newline at end of file